@@ -0,0 +1,74 @@
+# bench_pii.py
+import argparse
+import os
+import time
+
+from pii_crypto import PiiCipher
+from scratch_schema import drop_scratch_schema, use_scratch_schema
+from user_database import UserDatabase
+
+BENCH_SCHEMAS = {'plain': 'bench_pii_plain', 'encrypted': 'bench_pii_encrypted'}
+
+
+def run(mode: str, cipher, users: int) -> dict:
+    # Схема действует до конца замера: переподключение тоже не попадет в рабочую таблицу users
+    use_scratch_schema(BENCH_SCHEMAS[mode])
+    try:
+        return _measure(UserDatabase(cipher=cipher), users)
+    finally:
+        drop_scratch_schema(BENCH_SCHEMAS[mode])
+
+
+def _measure(database: UserDatabase, users: int) -> dict:
+    phones = [f"+7{9000000000 + i}" for i in range(users)]
+
+    started = time.perf_counter()
+    for i, phone in enumerate(phones):
+        database.register_user(str(i + 1), "Иванов Иван Иванович", phone, "13.03.2003")
+    registration_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for phone in phones:
+        database.find_user_by_phone(phone)
+    lookup_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(users):
+        database.get_user_greeting(str(i + 1))
+    greeting_time = time.perf_counter() - started
+
+    # Повторная регистрация с тем же телефоном должна отклоняться индексом
+    duplicate_rejected = not database.register_user(str(users + 1), "Петров Петр Петрович", phones[0], "01.01.1990")
+
+    database.close_connection()
+    return {
+        'register/s': users / registration_time,
+        'phone lookup/s': users / lookup_time,
+        'greeting/s': users / greeting_time,
+        'duplicate rejected': duplicate_rejected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение скорости регистрации и поиска с шифрованием и без")
+    parser.add_argument('--users', type=int, default=5000)
+    args = parser.parse_args()
+
+    cipher = PiiCipher(os.urandom(32))
+    results = {
+        'plain': run('plain', None, args.users),
+        'encrypted': run('encrypted', cipher, args.users),
+    }
+
+    print(f"{'':<20}{'plain':>14}{'encrypted':>14}")
+    for metric in results['plain']:
+        plain, encrypted = results['plain'][metric], results['encrypted'][metric]
+        if isinstance(plain, bool):
+            print(f"{metric:<20}{str(plain):>14}{str(encrypted):>14}")
+        else:
+            print(f"{metric:<20}{plain:>14.0f}{encrypted:>14.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
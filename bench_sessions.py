@@ -0,0 +1,98 @@
+# bench_sessions.py
+import argparse
+import gc
+import time
+import tracemalloc
+
+from sessions import RegistrationSession, SessionState
+
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Кузнецов", "Смирнов", "Попов", "Васильев", "Соколов"]
+
+
+def _inputs(i: int):
+    """Тексты сообщений одного пользователя: каждый раз новые строки, как из вебхука."""
+    fio = f"{SURNAMES[i % len(SURNAMES)]} Иван Иванович"
+    birth_date = f"{i % 28 + 1:02d}.{i % 12 + 1:02d}.{1940 + i % 70}"
+    phone = f"+7{9000000000 + i}"
+    return fio, birth_date, phone
+
+
+def fill_dicts(sessions: int) -> dict:
+    """Прежняя схема: вложенные словари, внешний пересоздается на каждом шаге."""
+    user_states = {}
+    for i in range(sessions):
+        chat_id_str = str(1000000000 + i)
+        fio, birth_date, phone = _inputs(i)
+        user_states[chat_id_str] = {'state': 'waiting_fio', 'data': {}}
+        user_data = user_states[chat_id_str]['data']
+        user_data['fio'] = fio
+        user_states[chat_id_str] = {'state': 'waiting_birth_date', 'data': user_data}
+        user_data['birth_date'] = birth_date
+        user_states[chat_id_str] = {'state': 'waiting_phone', 'data': user_data}
+        user_data['phone'] = phone
+        user_states[chat_id_str] = {'state': 'waiting_confirmation', 'data': user_data}
+    return user_states
+
+
+def fill_sessions(sessions: int) -> dict:
+    """Новая схема: RegistrationSession, переходы на месте."""
+    user_states = {}
+    for i in range(sessions):
+        chat_id = 1000000000 + i
+        fio, birth_date, phone = _inputs(i)
+        session = user_states[chat_id] = RegistrationSession()
+        session.fio = fio
+        session.state = session.next_state()
+        session.birth_date = birth_date
+        session.state = session.next_state()
+        session.phone = phone
+        session.state = SessionState.WAITING_CONFIRMATION
+    return user_states
+
+
+def measure(fill, sessions: int) -> dict:
+    # Время заполнения без tracemalloc: трассировка замедляет выделение памяти в разы
+    gc.collect()
+    started = time.perf_counter()
+    fill(sessions)
+    fill_time = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    user_states = fill(sessions)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Полный проход сборщика мусора по всем живым сессиям
+    started = time.perf_counter()
+    gc.collect()
+    gc_time = time.perf_counter() - started
+
+    del user_states
+    return {
+        'bytes/session': memory / sessions,
+        'total MB': memory / 1024 / 1024,
+        'fill ms': fill_time * 1000,
+        'gc.collect ms': gc_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память незавершенных регистраций: словари против RegistrationSession")
+    parser.add_argument('--sessions', type=int, default=100000)
+    args = parser.parse_args()
+
+    results = {
+        'dict': measure(fill_dicts, args.sessions),
+        'slotted': measure(fill_sessions, args.sessions),
+    }
+
+    print(f"{args.sessions} sessions")
+    print(f"{'':<20}{'dict':>14}{'slotted':>14}")
+    for metric in results['dict']:
+        print(f"{metric:<20}{results['dict'][metric]:>14.1f}{results['slotted'][metric]:>14.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
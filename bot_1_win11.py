@@ -53,73 +53,172 @@ MAP_OF_MEDICAL_INSTITUTIONS_URL = "https://yandex.ru/maps/959/sevastopol/search/
 
 # Импорт базы данных из отдельного файла
 from user_database import db
+from funnel_stats import FunnelStats
+import funnel_events
+from funnel_events import FunnelEventLog
+
+from lifecycle import BotLifecycle
+from tenants import Tenant, register_tenant, tenant_for, all_tenants
+from sessions import RegistrationSession, SessionState
+from health_server import HealthServer
+from message_templates import templates, StaticMessage
+from webhook_server import WebhookServer, WEBHOOK_SECRET
+from update_recorder import UpdateRecorder, RECORD_UPDATES_FILE
+
+# Агрегаты воронки регистрации для отчетов
+funnel_stats = FunnelStats(db)
+# Поток событий воронки (история переходов по каждому пользователю)
+funnel_log = FunnelEventLog()
+# Остановка по сигналу и снимок состояния между перезапусками
+lifecycle = BotLifecycle()
+# Проверки живости и готовности (состояние подключения к БД)
+health_server = HealthServer(db)
+# Сервер вебхука с проверкой секрета и ограничением частоты запросов
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/")
+# Запись входящих обновлений включается переменной RECORD_UPDATES_FILE
+update_recorder = UpdateRecorder(RECORD_UPDATES_FILE) if RECORD_UPDATES_FILE else None
+webhook_server = WebhookServer(
+    host='0.0.0.0',
+    port=80,
+    # Число прокси перед ботом, дописывающих X-Forwarded-For (0 - заголовок не учитывается)
+    trust_forwarded=int(os.getenv("WEBHOOK_TRUST_FORWARDED", "0")),
+    recorder=update_recorder,
+    lifecycle=lifecycle
+)
 
-# Словари для хранения состояний и защиты от дублирования
-user_states = {}
-greeted_users = set()
-processed_messages = set()
-processed_callbacks = set()
-last_processed = {}
 
+# Состояния регистрации и защита от дублирования хранятся отдельно для каждого бота (Tenant)
 
-# --- Вспомогательные функции ---
+def snapshot_state() -> dict:
+    """Собирает состояние всех ботов для сохранения при остановке"""
+    return {
+        'tenants': {tenant.name: tenant.snapshot(db.cipher) for tenant in all_tenants()},
+        # Регистрации, отложенные на время недоступности БД, не должны пропасть при перезапуске
+        'pending_registrations': db.pending_snapshot(),
+    }
+
+
+def restore_state(state: dict):
+    """Восстанавливает состояние ботов из снимка, сохраненного при остановке"""
+    db.restore_pending(state.get('pending_registrations', {}))
+    saved_tenants = state.get('tenants', {})
+    for tenant in all_tenants():
+        if tenant.name in saved_tenants:
+            tenant.restore(saved_tenants[tenant.name], db.cipher)
+            log_bot_event("State restored", f"Bot: {tenant.name}, "
+                                            f"Registrations in progress: {len(tenant.user_states)}")
 
-def create_main_menu_keyboard():
-    """Создает клавиатуру главного меню с 4 кнопками"""
-    buttons = [
-        [LinkButton(text="Записаться на приём к врачу", url=GOSUSLUGI_APPOINTMENT_URL)],
-        [LinkButton(text="Профосмотр/диспансеризация", url=GOSUSLUGI_MEDICAL_EXAM_URL)],
-        [LinkButton(text="Вызов врача на дом", url=GOSUSLUGI_DOCTOR_HOME_URL)],
-        [LinkButton(text="Прикрепление к поликлинике", url=GOSUSLUGI_ATTACH_TO_POLYCLINIC_URL)],
-        [LinkButton(text="Ближайшие гос мед учреждения", url=MAP_OF_MEDICAL_INSTITUTIONS_URL)],
-        [LinkButton(text="Единый контакт-центр", url=CONTACT_CENTER_URL)]
-    ]
 
+def invalidate_users(action: str, chat_ids: list):
+    """Сбрасывает данные пользователей в памяти после изменений через user_admin"""
+    if action != 'delete':
+        # Исправленные ФИО и телефон читаются из базы при каждом обращении
+        return
+
+    for chat_id in chat_ids:
+        # Удаленный пользователь при следующем запуске бота снова получит приветствие
+        db.pending_registrations.pop(chat_id, None)
+        funnel_stats.forget(chat_id)
+        for tenant in all_tenants():
+            tenant.greeted_users.discard(int(chat_id))
+    log_bot_event("Users removed by admin", f"Count: {len(chat_ids)}")
+
+
+# --- Вспомогательные функции ---
+
+def create_keyboard(buttons: list) -> Attachment:
+    """Создает вложение с инлайн-клавиатурой"""
     buttons_payload = ButtonsPayload(buttons=buttons)
-    keyboard_attachment = Attachment(
+    return Attachment(
         type=AttachmentType.INLINE_KEYBOARD,
         payload=buttons_payload
     )
 
-    return keyboard_attachment
+
+def create_main_menu_keyboard():
+    """Создает клавиатуру главного меню"""
+    return create_keyboard([
+        [LinkButton(text=templates.render('button_appointment'), url=GOSUSLUGI_APPOINTMENT_URL)],
+        [LinkButton(text=templates.render('button_medical_exam'), url=GOSUSLUGI_MEDICAL_EXAM_URL)],
+        [LinkButton(text=templates.render('button_doctor_home'), url=GOSUSLUGI_DOCTOR_HOME_URL)],
+        [LinkButton(text=templates.render('button_attach_to_polyclinic'), url=GOSUSLUGI_ATTACH_TO_POLYCLINIC_URL)],
+        [LinkButton(text=templates.render('button_medical_institutions'), url=MAP_OF_MEDICAL_INSTITUTIONS_URL)],
+        [LinkButton(text=templates.render('button_contact_center'), url=CONTACT_CENTER_URL)]
+    ])
+
+
+def create_confirmation_keyboard():
+    """Создает клавиатуру подтверждения и исправления данных"""
+    return create_keyboard([
+        [CallbackButton(text=templates.render('button_correct_fio'), payload=CORRECT_FIO_CALLBACK)],
+        [CallbackButton(text=templates.render('button_correct_birth_date'), payload=CORRECT_BIRTH_DATE_CALLBACK)],
+        [CallbackButton(text=templates.render('button_correct_phone'), payload=CORRECT_PHONE_CALLBACK)],
+        [CallbackButton(text=templates.render('button_confirm'), payload=CONFIRM_DATA_CALLBACK)]
+    ])
+
+
+# Готовые сообщения и клавиатуры, пересобираются при изменении messages.json
+static_messages = {}
+keyboards = {}
+
+
+@templates.on_reload
+def build_static_messages():
+    """Собирает статические сообщения вместе с их клавиатурами"""
+    # Сначала собираем все, затем заменяем разом: при ошибке остаются прежние сообщения
+    new_keyboards = {
+        'main_menu': create_main_menu_keyboard(),
+        'confirmation': create_confirmation_keyboard(),
+    }
+    new_messages = {
+        'welcome': StaticMessage(
+            templates.render('welcome'),
+            [create_keyboard([[CallbackButton(text=templates.render('button_continue'), payload=CONTINUE_CALLBACK)]])]
+        ),
+        'agreement': StaticMessage(
+            templates.render('agreement', sogl_link=SOGL_LINK),
+            [create_keyboard([[CallbackButton(text=templates.render('button_agreement'), payload=AGREEMENT_CALLBACK)]])]
+        ),
+    }
+    keyboards.update(new_keyboards)
+    static_messages.update(new_messages)
+
+
+async def send_static_message(bot_instance: Bot, chat_id: int, name: str):
+    """Отправляет заранее собранное сообщение"""
+    message = static_messages[name]
+    await bot_instance.send_message(
+        chat_id=chat_id,
+        text=message.text,
+        attachments=message.attachments
+    )
 
 
 async def send_main_menu(bot_instance: Bot, chat_id: int, greeting_name: str):
     """Отправляет главное меню с приветствием"""
-    keyboard = create_main_menu_keyboard()
-
     await bot_instance.send_message(
         chat_id=chat_id,
-        text=f"Здравствуйте, {greeting_name}!\n\n"
-             "Выберите услугу:",
-        attachments=[keyboard]
+        text=templates.render('main_menu', greeting_name=greeting_name),
+        attachments=[keyboards['main_menu']]
     )
 
 
 async def send_agreement_message(bot_instance: Bot, chat_id: int):
     """Отправляет сообщение с соглашением"""
-    agreement_button = CallbackButton(
-        text="Согласие на обработку персональных данных",
-        payload=AGREEMENT_CALLBACK
-    )
+    await send_static_message(bot_instance, chat_id, 'agreement')
 
-    buttons_payload = ButtonsPayload(buttons=[[agreement_button]])
-    keyboard_attachment = Attachment(
-        type=AttachmentType.INLINE_KEYBOARD,
-        payload=buttons_payload
-    )
 
-    await bot_instance.send_message(
-        chat_id=chat_id,
-        text='Продолжая, Вы даёте согласие на обработку персональных данных.\n'
-             f'Ознакомиться с документом вы можете по ссылке {SOGL_LINK}',
-        attachments=[keyboard_attachment]
-    )
+def registration_session(user_states: dict, chat_id: int) -> RegistrationSession:
+    """Возвращает незавершенную регистрацию чата, создавая ее при необходимости"""
+    session = user_states.get(chat_id)
+    if session is None:
+        session = user_states[chat_id] = RegistrationSession()
+    return session
 
 
 async def start_fio_request(bot_instance: Bot, chat_id: int):
     """Начинает процесс регистрации - запрос ФИО"""
-    user_states[str(chat_id)] = {'state': 'waiting_fio', 'data': {}}
+    tenant_for(bot_instance).user_states[chat_id] = RegistrationSession()
 
     # Логирование начала регистрации
     log_user_event(str(chat_id), "registration started")
@@ -127,15 +226,13 @@ async def start_fio_request(bot_instance: Bot, chat_id: int):
     # Первое сообщение
     await bot_instance.send_message(
         chat_id=chat_id,
-        text='Для начала работы необходимо пройти регистрацию.'
+        text=templates.render('registration_start')
     )
 
     # Второе сообщение с инструкцией
     await bot_instance.send_message(
         chat_id=chat_id,
-        text='Пожалуйста, введите ваше ФИО в формате:\n'
-             'Фамилия Имя Отчество\n\n'
-             'Пример: Иванов Иван Иванович'
+        text=templates.render('fio_request')
     )
 
 
@@ -144,9 +241,7 @@ async def request_fio_correction(bot_instance: Bot, chat_id: int):
     log_user_event(str(chat_id), "requested FIO correction")
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="Введите ваше ФИО для исправления:\n\n"
-             "Формат: Фамилия Имя Отчество\n"
-             "Пример: Иванов Иван Иванович"
+        text=templates.render('fio_correction')
     )
 
 
@@ -155,9 +250,7 @@ async def request_birth_date_correction(bot_instance: Bot, chat_id: int):
     log_user_event(str(chat_id), "requested birth date correction")
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="Введите вашу дату рождения для исправления:\n\n"
-             "Формат: ДД.ММ.ГГГГ\n"
-             "Пример: 13.03.2003"
+        text=templates.render('birth_date_correction')
     )
 
 
@@ -166,8 +259,7 @@ async def request_phone_correction(bot_instance: Bot, chat_id: int):
     log_user_event(str(chat_id), "requested phone correction")
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="Введите ваш номер телефона для исправления:\n\n"
-             "Пример: +79781234567"
+        text=templates.render('phone_correction')
     )
 
 
@@ -175,64 +267,56 @@ async def request_phone_number(bot_instance: Bot, chat_id: int):
     """Запрашивает номер телефона"""
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="Отлично!\n"
-             "Теперь введите ваш номер телефона\n\n"
-             "Пример: +79781234567\n\n"
+        text=templates.render('phone_request')
     )
 
 
 # --- Обработчики событий ---
 
-@dp.bot_started()
+@lifecycle.tracked
 async def bot_started(event: BotStarted):
     """Обработка запуска бота"""
     chat_id = event.chat_id
     chat_id_str = str(chat_id)
+    tenant = tenant_for(event.bot)
+    greeted_users = tenant.greeted_users
 
     # Логирование события запуска бота
     log_user_event(chat_id_str, "bot started")
 
-    # Проверяем, не отправляли ли уже приветствие
-    if chat_id_str in greeted_users:
+    # Защита от повторной доставки того же обновления
+    start_id = (chat_id, event.timestamp)
+    if start_id in tenant.processed_starts:
+        return
+    tenant.processed_starts.add(start_id)
+    if len(tenant.processed_starts) > 1000:
+        tenant.processed_starts.clear()
+
+    # Повторный запуск во время регистрации не сбрасывает ее
+    if chat_id in greeted_users and chat_id in tenant.user_states:
         return
 
     try:
         # Проверяем, зарегистрирован ли пользователь
-        if db.is_user_registered(chat_id_str):
+        registered = db.is_user_registered(chat_id_str, tenant.name)
+        # Зарегистрированному пользователю меню отправляется один раз; незарегистрированный
+        # без начатой регистрации снова получает приветствие, иначе его сообщения игнорируются
+        if registered and chat_id in greeted_users:
+            return
+
+        if registered:
             # Пользователь уже зарегистрирован - показываем главное меню
-            greeting_name = db.get_user_greeting(chat_id_str)
+            greeting_name = db.get_user_greeting(chat_id_str, tenant.name)
             log_user_event(chat_id_str, "already registered, showing main menu")
             await send_main_menu(event.bot, chat_id, greeting_name)
         else:
             # Начинаем регистрацию
             log_user_event(chat_id_str, "new user, starting registration")
-            continue_button = CallbackButton(
-                text="Продолжить",
-                payload=CONTINUE_CALLBACK
-            )
-
-            buttons_payload = ButtonsPayload(buttons=[[continue_button]])
-            keyboard_attachment = Attachment(
-                type=AttachmentType.INLINE_KEYBOARD,
-                payload=buttons_payload
-            )
-
-            await event.bot.send_message(
-                chat_id=chat_id,
-                text='Здравствуйте! 👩‍⚕️\n\n'
-                     'Вы обратились в Медицинский информационно-аналитический центр города Севастополя.\n'
-                     'Наша система позволяет Вам удобно и быстро решить следующие задачи:\n\n'
-                     '📌 Записаться на приём к врачу;\n'
-                     '📌 Вызвать врача на дом;\n'
-                     '📌 Записаться на профилактический медосмотр/диспансеризацию;\n'
-                     '📌 Прикрепиться к поликлинике;\n'
-                     '📌 Получать уведомления о записи к врачу с возможностью её отмены;\n'
-                     '📌 Найти ближайшие государственные медицинские учреждения.'
-                ,
-                attachments=[keyboard_attachment]
-            )
+            funnel_stats.advance(chat_id_str, 'bot_started')
+            funnel_log.append(chat_id, funnel_events.EVENT_BOT_STARTED)
+            await send_static_message(event.bot, chat_id, 'welcome')
 
-        greeted_users.add(chat_id_str)
+        greeted_users.add(chat_id)
     except Exception as e:
         log_error("Failed to send welcome message", f"User {chat_id}: {str(e)}")
         log_warning("Message sending failed", f"User {chat_id}")
@@ -242,86 +326,63 @@ async def request_birth_date(bot_instance: Bot, chat_id: int):
     """Запрашивает дату рождения"""
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="Отлично!\n"
-             "Теперь введите вашу дату рождения\n\n"
-             "Формат: ДД.ММ.ГГГГ\n"
-             "Пример: 13.03.2003"
+        text=templates.render('birth_date_request')
     )
 
 
-async def send_confirmation_message(bot_instance: Bot, chat_id: int, user_data: dict):
+async def send_confirmation_message(bot_instance: Bot, chat_id: int, session: RegistrationSession):
     """Отправляет сообщение с подтверждением данных"""
-    fio = user_data.get('fio', 'Не указано')
-    birth_date = user_data.get('birth_date', 'Не указано')
-    phone = user_data.get('phone', 'Не указано')
+    not_specified = templates.render('not_specified')
+    fio = session.fio or not_specified
+    birth_date = session.birth_date or not_specified
+    phone = session.phone or not_specified
 
     # Логирование данных для подтверждения
     log_user_event(str(chat_id), "showing confirmation", f"FIO: {fio}, Birth: {birth_date}, Phone: {phone}")
 
-    # Создаем кнопки для исправления
-    correct_fio_button = CallbackButton(
-        text="⚠️ Исправить ФИО",
-        payload=CORRECT_FIO_CALLBACK
-    )
-    correct_birth_date_button = CallbackButton(
-        text="⚠️ Исправить дату рождения",
-        payload=CORRECT_BIRTH_DATE_CALLBACK
-    )
-    correct_phone_button = CallbackButton(
-        text="⚠️ Исправить телефон",
-        payload=CORRECT_PHONE_CALLBACK
-    )
-    confirm_button = CallbackButton(
-        text="✅ Всё верно, подтвердить",
-        payload=CONFIRM_DATA_CALLBACK
-    )
-
-    buttons_payload = ButtonsPayload(buttons=[
-        [correct_fio_button],
-        [correct_birth_date_button],
-        [correct_phone_button],
-        [confirm_button]
-    ])
-    keyboard_attachment = Attachment(
-        type=AttachmentType.INLINE_KEYBOARD,
-        payload=buttons_payload
-    )
-
     await bot_instance.send_message(
         chat_id=chat_id,
-        text="📋 Пожалуйста, проверьте введенные данные:\n\n"
-             f"👤 ФИО: {fio}\n\n"
-             f"🎂 Дата рождения: {birth_date}\n\n"
-             f"📞 Телефон: {phone}\n\n"
-             "Если всё верно - нажмите 'Подтвердить', "
-             "или выберите что нужно исправить:",
-        attachments=[keyboard_attachment]
+        text=templates.render('confirmation', fio=fio, birth_date=birth_date, phone=phone),
+        attachments=[keyboards['confirmation']]
     )
 
 
-async def complete_registration(bot_instance: Bot, chat_id: int, user_data: dict):
+async def request_next_field(bot_instance: Bot, chat_id: int, session: RegistrationSession):
+    """Запрашивает поле, которое ожидает регистрация, или показывает подтверждение"""
+    if session.state == SessionState.WAITING_BIRTH_DATE:
+        await request_birth_date(bot_instance, chat_id)
+    elif session.state == SessionState.WAITING_PHONE:
+        await request_phone_number(bot_instance, chat_id)
+    else:
+        await send_confirmation_message(bot_instance, chat_id, session)
+
+
+async def complete_registration(bot_instance: Bot, chat_id: int, session: RegistrationSession):
     """Завершает регистрацию и показывает главное меню"""
-    fio = user_data['fio']
-    birth_date = user_data['birth_date']
-    phone = user_data['phone']
+    tenant = tenant_for(bot_instance)
+    user_states = tenant.user_states
+    fio = session.fio
+    birth_date = session.birth_date
+    phone = session.phone
 
-    success = db.register_user(str(chat_id), fio, phone, birth_date)
+    success = db.register_user(str(chat_id), fio, phone, birth_date, tenant.name)
 
     if success:
         # Удаляем состояние перед отправкой сообщения
-        user_states.pop(str(chat_id), None)
+        user_states.pop(chat_id, None)
 
         # Получаем приветствие по имени и отчеству
-        greeting_name = db.get_user_greeting(str(chat_id))
+        greeting_name = db.get_user_greeting(str(chat_id), tenant.name)
 
         # Логирование успешной регистрации
         log_user_event(str(chat_id), "registration completed successfully")
+        funnel_stats.advance(str(chat_id), 'confirmed', birth_date)
+        funnel_log.append(chat_id, funnel_events.EVENT_CONFIRMED)
 
         # Отправляем сообщение об успешной регистрации
         await bot_instance.send_message(
             chat_id=chat_id,
-            text=f"✅ Успешная регистрация!\n"
-                 f"Теперь вы можете пользоваться всеми функциями бота."
+            text=templates.render('registration_success')
         )
 
         # Отправляем главное меню
@@ -329,20 +390,24 @@ async def complete_registration(bot_instance: Bot, chat_id: int, user_data: dict
 
     else:
         # Ошибка при сохранении
-        user_states.pop(str(chat_id), None)
+        user_states.pop(chat_id, None)
         log_error("Registration failed - duplicate user", f"User {chat_id}, FIO: {fio}, Phone: {phone}")
+        funnel_log.append(chat_id, funnel_events.EVENT_REGISTRATION_FAILED)
         await bot_instance.send_message(
             chat_id=chat_id,
-            text=f"🚨 Ошибка при регистрации. Комбинация ФИО и телефона уже существует.\n\n"
-                 f"Пожалуйста, обратитесь к администратору, {ADMIN_CONTACT}."
+            text=templates.render('registration_duplicate', admin_contact=ADMIN_CONTACT)
         )
 
 
-@dp.message_callback()
+@lifecycle.tracked
 async def message_callback(event: MessageCallback):
     """Обработка нажатий на инлайн-кнопки"""
     chat_id = event.message.recipient.chat_id
     chat_id_str = str(chat_id)
+    tenant = tenant_for(event.bot)
+    user_states = tenant.user_states
+    processed_callbacks = tenant.processed_callbacks
+    last_processed = tenant.last_processed
 
     # Логирование callback события
     log_user_event(chat_id_str, "button pressed", f"Payload: {event.callback.payload}")
@@ -364,59 +429,71 @@ async def message_callback(event: MessageCallback):
 
     if event.callback.payload == CONTINUE_CALLBACK:
         log_user_event(chat_id_str, "continue button pressed")
+        funnel_log.append(chat_id, funnel_events.EVENT_CONTINUE)
         await send_agreement_message(event.bot, chat_id)
 
     elif event.callback.payload == AGREEMENT_CALLBACK:
         log_user_event(chat_id_str, "agreement accepted")
+        funnel_stats.advance(chat_id_str, 'agreement')
+        funnel_log.append(chat_id, funnel_events.EVENT_AGREEMENT)
         await start_fio_request(event.bot, chat_id)
 
     # Обработка кнопок исправления данных
     elif event.callback.payload == CORRECT_FIO_CALLBACK:
         # Сохраняем уже введенные данные кроме ФИО
-        current_data = user_states.get(chat_id_str, {}).get('data', {})
-        current_data.pop('fio', None)  # Удаляем старое ФИО
-        user_states[chat_id_str] = {'state': 'waiting_fio', 'data': current_data}
+        session = registration_session(user_states, chat_id)
+        session.fio = None  # Удаляем старое ФИО
+        session.state = SessionState.WAITING_FIO
         log_user_event(chat_id_str, "FIO correction requested")
+        funnel_log.append(chat_id, funnel_events.EVENT_CORRECT_FIO)
         await request_fio_correction(event.bot, chat_id)
 
     elif event.callback.payload == CORRECT_BIRTH_DATE_CALLBACK:
         # Сохраняем уже введенные данные кроме даты рождения
-        current_data = user_states.get(chat_id_str, {}).get('data', {})
-        current_data.pop('birth_date', None)  # Удаляем старую дату
-        user_states[chat_id_str] = {'state': 'waiting_birth_date', 'data': current_data}
+        session = registration_session(user_states, chat_id)
+        session.birth_date = None  # Удаляем старую дату
+        session.state = SessionState.WAITING_BIRTH_DATE
         log_user_event(chat_id_str, "birth date correction requested")
+        funnel_log.append(chat_id, funnel_events.EVENT_CORRECT_BIRTH_DATE)
         await request_birth_date_correction(event.bot, chat_id)
 
     elif event.callback.payload == CORRECT_PHONE_CALLBACK:
         # Сохраняем уже введенные данные кроме телефона
-        current_data = user_states.get(chat_id_str, {}).get('data', {})
-        current_data.pop('phone', None)  # Удаляем старый телефон
-        user_states[chat_id_str] = {'state': 'waiting_phone', 'data': current_data}
+        session = registration_session(user_states, chat_id)
+        session.phone = None  # Удаляем старый телефон
+        session.state = SessionState.WAITING_PHONE
         log_user_event(chat_id_str, "phone correction requested")
+        funnel_log.append(chat_id, funnel_events.EVENT_CORRECT_PHONE)
         await request_phone_correction(event.bot, chat_id)
 
     elif event.callback.payload == CONFIRM_DATA_CALLBACK:
         log_user_event(chat_id_str, "data confirmation requested")
+        funnel_log.append(chat_id, funnel_events.EVENT_CONFIRM_REQUESTED)
         # Завершаем регистрацию
-        user_data = user_states.get(chat_id_str, {}).get('data', {})
+        session = user_states.get(chat_id)
 
-        if user_data and all(key in user_data for key in ['fio', 'birth_date', 'phone']):
-            await complete_registration(event.bot, chat_id, user_data)
+        if session is not None and session.is_complete:
+            await complete_registration(event.bot, chat_id, session)
         else:
             # Если данных недостаточно, начинаем заново
             log_error("Incomplete data on confirmation", f"User {chat_id_str}")
+            funnel_log.append(chat_id, funnel_events.EVENT_RESTARTED)
             await event.bot.send_message(
                 chat_id=chat_id,
-                text="❌ Не все данные заполнены. Начинаем регистрацию заново."
+                text=templates.render('incomplete_data')
             )
             await start_fio_request(event.bot, chat_id)
 
 
-@dp.message_created()
+@lifecycle.tracked
 async def handle_message(event: MessageCreated):
     """Обработка всех текстовых сообщений"""
     chat_id = event.message.recipient.chat_id
     chat_id_str = str(chat_id)
+    tenant = tenant_for(event.bot)
+    user_states = tenant.user_states
+    processed_messages = tenant.processed_messages
+    last_processed = tenant.last_processed
 
     # Проверяем базовые условия
     if not event.message.body or not event.message.body.text:
@@ -440,119 +517,63 @@ async def handle_message(event: MessageCreated):
         return
 
     # Если пользователь не зарегистрирован и не в процессе регистрации, игнорируем
-    if not db.is_user_registered(chat_id_str) and chat_id_str not in user_states:
+    if not db.is_user_registered(chat_id_str, tenant.name) and chat_id not in user_states:
         log_user_event(chat_id_str, "message from unregistered user ignored")
         return
 
     # Проверяем состояние пользователя (процесс регистрации)
-    state_info = user_states.get(chat_id_str)
-    if not state_info:
+    session = user_states.get(chat_id)
+    if session is None:
         return
 
-    state = state_info.get('state')
-    user_data = state_info.get('data', {})
+    state = session.state
 
     # --- Ожидание ФИО ---
-    if state == 'waiting_fio':
+    if state == SessionState.WAITING_FIO:
         if not message_text:
-            await event.message.answer(
-                "ФИО не может быть пустым. Пожалуйста, введите ваше ФИО в формате: Фамилия Имя Отчество"
-            )
+            await event.message.answer(templates.render('fio_empty'))
             return
 
         if not db.validate_fio(message_text):
             log_user_event(chat_id_str, "invalid FIO format", f"Input: {message_text}")
-            await event.message.answer(
-                "❌ Ошибка формата!\n\n"
-                "Пожалуйста, введите ваше ФИО в таком формате: Фамилия Имя Отчество\n\n"
-                "Пример: Иванов Иван Иванович"
-            )
+            await event.message.answer(templates.render('fio_invalid'))
             return
 
         # Сохраняем ФИО
-        user_data['fio'] = message_text
+        session.fio = message_text
         log_user_event(chat_id_str, "FIO entered", f"FIO: {message_text}")
+        funnel_stats.advance(chat_id_str, 'fio')
 
-        # Проверяем, все ли данные уже есть для подтверждения
-        if all(key in user_data for key in ['fio', 'birth_date', 'phone']):
-            # Все данные есть - переходим к подтверждению
-            user_states[chat_id_str] = {
-                'state': 'waiting_confirmation',
-                'data': user_data
-            }
-            await send_confirmation_message(event.bot, chat_id, user_data)
-        elif 'birth_date' in user_data and 'phone' not in user_data:
-            # Есть ФИО и дата, но нет телефона
-            user_states[chat_id_str] = {
-                'state': 'waiting_phone',
-                'data': user_data
-            }
-            await request_phone_number(event.bot, chat_id)
-        elif 'birth_date' not in user_data:
-            # Нет даты рождения - запрашиваем её
-            user_states[chat_id_str] = {
-                'state': 'waiting_birth_date',
-                'data': user_data
-            }
-            await request_birth_date(event.bot, chat_id)
-        else:
-            # Во всех остальных случаях переходим к подтверждению
-            user_states[chat_id_str] = {
-                'state': 'waiting_confirmation',
-                'data': user_data
-            }
-            await send_confirmation_message(event.bot, chat_id, user_data)
+        # Переходим к первому недостающему полю или к подтверждению
+        session.state = session.next_state()
+        funnel_log.append(chat_id, funnel_events.EVENT_FIO_ENTERED, session.state)
+        await request_next_field(event.bot, chat_id, session)
 
     # --- Ожидание даты рождения ---
-    elif state == 'waiting_birth_date':
+    elif state == SessionState.WAITING_BIRTH_DATE:
         if not message_text:
-            await event.message.answer(
-                "Дата рождения не может быть пустой. Пожалуйста, введите дату в формате: ДД.ММ.ГГГГ"
-            )
+            await event.message.answer(templates.render('birth_date_empty'))
             return
 
         if not db.validate_birth_date(message_text):
             log_user_event(chat_id_str, "invalid birth date format", f"Input: {message_text}")
-            await event.message.answer(
-                "❌ Ошибка формата!\n\n"
-                "Пожалуйста, введите дату рождения в формате: ДД.ММ.ГГГГ\n\n"
-                "Пример: 13.03.2003"
-            )
+            await event.message.answer(templates.render('birth_date_invalid'))
             return
 
         # Сохраняем дату рождения
-        user_data['birth_date'] = message_text
+        session.birth_date = message_text
         log_user_event(chat_id_str, "birth date entered", f"Date: {message_text}")
+        funnel_stats.advance(chat_id_str, 'birth_date')
 
-        # Проверяем, все ли данные уже есть для подтверждения
-        if all(key in user_data for key in ['fio', 'birth_date', 'phone']):
-            # Все данные есть - переходим к подтверждению
-            user_states[chat_id_str] = {
-                'state': 'waiting_confirmation',
-                'data': user_data
-            }
-            await send_confirmation_message(event.bot, chat_id, user_data)
-        elif 'phone' not in user_data:
-            # Нет телефона - запрашиваем его
-            user_states[chat_id_str] = {
-                'state': 'waiting_phone',
-                'data': user_data
-            }
-            await request_phone_number(event.bot, chat_id)
-        else:
-            # Есть все данные - переходим к подтверждению
-            user_states[chat_id_str] = {
-                'state': 'waiting_confirmation',
-                'data': user_data
-            }
-            await send_confirmation_message(event.bot, chat_id, user_data)
+        # Переходим к телефону, если его еще нет, иначе к подтверждению
+        session.state = session.next_state()
+        funnel_log.append(chat_id, funnel_events.EVENT_BIRTH_DATE_ENTERED, session.state)
+        await request_next_field(event.bot, chat_id, session)
 
     # --- Ожидание телефона ---
-    elif state == 'waiting_phone':
+    elif state == SessionState.WAITING_PHONE:
         if not message_text:
-            await event.message.answer(
-                "Номер телефона не может быть пустым. Пожалуйста, введите Ваш номер телефона в формате: +79781111111"
-            )
+            await event.message.answer(templates.render('phone_empty'))
             return
 
         # Нормализуем телефон
@@ -560,17 +581,13 @@ async def handle_message(event: MessageCreated):
 
         if not db.validate_phone(phone_normalized):
             log_user_event(chat_id_str, "invalid phone format", f"Input: {message_text}")
-            await event.message.answer(
-                "❌ Ошибка формата!\n\n"
-                "Пожалуйста, введите Ваш номер телефона в таком формате:\n"
-                "+79781111111\n\n"
-                "Пример: +79781234567"
-            )
+            await event.message.answer(templates.render('phone_invalid'))
             return
 
         # Сохраняем телефон
-        user_data['phone'] = phone_normalized
+        session.phone = phone_normalized
         log_user_event(chat_id_str, "phone entered", f"Phone: {phone_normalized}")
+        funnel_stats.advance(chat_id_str, 'phone')
 
         # Защита от дублирования
         current_time = time.time()
@@ -580,44 +597,109 @@ async def handle_message(event: MessageCreated):
         last_processed[chat_id_str] = current_time
 
         # Всегда переходим к подтверждению после ввода телефона
-        user_states[chat_id_str] = {
-            'state': 'waiting_confirmation',
-            'data': user_data
-        }
-        await send_confirmation_message(event.bot, chat_id, user_data)
+        session.state = SessionState.WAITING_CONFIRMATION
+        funnel_log.append(chat_id, funnel_events.EVENT_PHONE_ENTERED)
+        await send_confirmation_message(event.bot, chat_id, session)
+
+
+def register_handlers(dispatcher: Dispatcher):
+    """Подключает обработчики бота к диспетчеру"""
+    dispatcher.bot_started()(bot_started)
+    dispatcher.message_callback()(message_callback)
+    dispatcher.message_created()(handle_message)
+
+
+register_handlers(dp)
 
 
 # --- Запуск вебхука ---
 
-async def setup_webhook():
+async def setup_webhook(tenant: Tenant):
     """Настраивает вебхук через Xtunnel"""
-    log_bot_event("Setting up webhook", f"URL: {X_TUNNEL_URL}")
-    await bot.subscribe_webhook(
-        url=X_TUNNEL_URL,
+    log_bot_event("Setting up webhook", f"Bot: {tenant.name}, URL: {tenant.webhook_url}")
+    # Секрет передается только если задан - MAX вернет его в заголовке каждого запроса
+    secret_kwargs = {'secret': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    await tenant.bot.subscribe_webhook(
+        url=tenant.webhook_url,
         update_types=[
             "message_created",
             "message_callback",
             "bot_started"
-        ]
+        ],
+        **secret_kwargs
     )
     log_bot_event("Webhook setup complete")
 
 
-async def main():
-    # Логирование запуска бота
-    log_bot_event("Bot starting")
+async def shutdown(server_task: asyncio.Task):
+    """Корректно останавливает бота: дожидается обработчиков и сохраняет состояние"""
+    # Новые обновления получают 503 и будут доставлены MAX повторно
+    webhook_server.stop_accepting()
+    await lifecycle.drain()
 
-    # Сначала настраиваем вебхук
-    await setup_webhook()
+    await webhook_server.stop()
+    if not server_task.done():
+        server_task.cancel()
+    try:
+        await server_task
+    except asyncio.CancelledError:
+        pass
+
+    lifecycle.save_snapshot(snapshot_state())
+    for tenant in all_tenants():
+        tenant.greeted_users.save(tenant.greeted_file)
+    funnel_log.flush()
+    funnel_stats.flush()
+    if update_recorder:
+        update_recorder.flush()
+    await health_server.stop()
+    db.close_connection()
+    log_bot_event("Bot stopped")
+
+
+async def run_tenants():
+    """Запускает всех зарегистрированных ботов на общем сервере вебхука"""
+    tenants = all_tenants()
+    # Логирование запуска бота
+    log_bot_event("Bot starting", f"Bots: {', '.join(tenant.name for tenant in tenants)}")
+
+    # Восстанавливаем состояние, сохраненное при предыдущей остановке
+    restore_state(lifecycle.load_snapshot())
+    for tenant in tenants:
+        tenant.greeted_users.load(tenant.greeted_file)
+    lifecycle.install_signal_handlers()
+
+    # Сначала настраиваем вебхуки
+    for tenant in tenants:
+        webhook_server.add_route(tenant.webhook_path, tenant.bot, tenant.dispatcher)
+        await setup_webhook(tenant)
+
+    # Контроль соединения с БД и эндпоинты готовности
+    await health_server.start()
+    asyncio.create_task(db.run_supervisor())
+    asyncio.create_task(db.run_change_listener(invalidate_users))
+
+    # Фоновый сброс статистики воронки в базу данных
+    asyncio.create_task(funnel_stats.run_flusher())
+    asyncio.create_task(funnel_log.run_flusher())
+    for tenant in tenants:
+        asyncio.create_task(tenant.greeted_users.run_saver(tenant.greeted_file))
+    if update_recorder:
+        asyncio.create_task(update_recorder.run_flusher())
 
     # Затем запускаем сервер
     log_bot_event("Starting webhook server")
-    await dp.handle_webhook(
-        bot=bot,
-        host='0.0.0.0',
-        port=80,
-        log_level='info'
-    )
+    server_task = asyncio.create_task(webhook_server.serve())
+
+    try:
+        await lifecycle.run_until_shutdown(server_task)
+    finally:
+        await shutdown(server_task)
+
+
+async def main():
+    register_tenant(Tenant('default', bot, dp, X_TUNNEL_URL, WEBHOOK_PATH))
+    await run_tenants()
 
 
 if __name__ == "__main__":
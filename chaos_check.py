@@ -0,0 +1,522 @@
+# chaos_check.py
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+# Настоящая база данных (DB_HOST/DB_PORT); бот подключается к ней только через FaultProxy
+from scratch_schema import DB_HOST, DB_PORT, admin_execute, drop_scratch_schema, use_scratch_schema
+
+CHAOS_SCHEMA = 'chaos_check'
+CHAOS_SECRET = 'chaos-check-secret'
+
+# Повторная доставка обновления, как это делает MAX при ответе не 200
+DELIVERY_ATTEMPTS = 4
+REDELIVERY_DELAY = 0.2
+DELIVERY_TIMEOUT = 10.0
+
+BOT_USER = {'user_id': 1, 'first_name': 'Chaos', 'username': 'chaos_bot', 'is_bot': True,
+            'last_activity_time': 0}
+
+# Сценарии отказов и допустимые границы: p95 задержки ответа вебхука (сек),
+# число повторно отправленных сообщений и потерянных регистраций. Границы взяты
+# по замерам на PostgreSQL с запасом; max_loop_lag - самая долгая блокировка
+# цикла событий бота (сек), recovery - время от конца отказа до первого
+# успешного запроса к базе (сек)
+SCENARIOS = {
+    'baseline': {'p95': 0.1},
+    # Синхронные запросы к базе блокируют цикл событий, поэтому задержка
+    # сети до базы копится в очереди вебхуков
+    'db_latency': {'db_latency': 0.01, 'p95': 10.0, 'max_loop_lag': 5.0},
+    'db_drops': {'db_drop_interval': 2.0, 'p95': 0.1},
+    'db_outage': {'db_outage': (2.0, 5.0), 'p95': 0.1, 'recovery': 3.0},
+    'db_stall': {'db_stall': (2.0, 3.0), 'p95': 1.0, 'max_loop_lag': 3.5},
+    # Зависание дольше любой допустимой задержки: запрос прерывается по
+    # DB_QUERY_TIMEOUT, регистрации откладываются, а после окончания отказа
+    # соединение восстанавливается
+    'db_stall_long': {'db_stall': (2.0, 20.0), 'p95': 1.0, 'max_loop_lag': 7.0, 'recovery': 5.0},
+    'api_latency': {'api_latency': 0.2, 'p95': 1.0},
+    'api_errors': {'api_error_rate': 0.2, 'p95': 0.2},
+    'api_resets': {'api_reset_rate': 0.1, 'p95': 0.2},
+    'redelivery': {'redelivery_rate': 0.3, 'p95': 0.2},
+}
+
+
+class FaultLoop:
+    """Отдельный поток с циклом событий для прокси и фальшивого API.
+
+    Бот обращается к psycopg2 синхронно и блокирует свой цикл событий, поэтому
+    источники отказов работают в своем потоке и не зависают вместе с ботом.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def call(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class FaultProxy:
+    """TCP-прокси перед PostgreSQL: задержка, обрыв соединений, отказ и зависание."""
+
+    def __init__(self, target_host: str, target_port: int, host: str = '127.0.0.1'):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.host = host
+        self.port = None
+        self.latency = 0.0
+        self.refuse = False
+        self.connections = set()
+        self.dropped = 0
+        self._flowing = None
+        self._server = None
+
+    async def start(self):
+        self._flowing = asyncio.Event()
+        self._flowing.set()
+        self._server = await asyncio.start_server(self._accept, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _accept(self, reader, writer):
+        if self.refuse:
+            writer.transport.abort()
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            writer.transport.abort()
+            return
+
+        pair = (writer, upstream_writer)
+        self.connections.add(pair)
+        try:
+            await asyncio.gather(self._pipe(reader, upstream_writer), self._pipe(upstream_reader, writer))
+        finally:
+            self.connections.discard(pair)
+            writer.transport.abort()
+            upstream_writer.transport.abort()
+
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                await self._flowing.wait()
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.transport.abort()
+
+    def drop_connections(self):
+        """Обрывает все открытые соединения (RST), как при падении сети или рестарте базы."""
+        for client_writer, upstream_writer in list(self.connections):
+            client_writer.transport.abort()
+            upstream_writer.transport.abort()
+            self.dropped += 1
+
+    def reset(self):
+        self.latency = 0.0
+        self.refuse = False
+        self._flowing.set()
+
+    async def outage(self, after: float, duration: float):
+        """База недоступна duration секунд: соединения обрываются, новые отклоняются."""
+        await asyncio.sleep(after)
+        self.refuse = True
+        self.drop_connections()
+        await asyncio.sleep(duration)
+        self.refuse = False
+
+    async def stall(self, after: float, duration: float):
+        """Данные перестают передаваться duration секунд, соединения остаются открытыми."""
+        await asyncio.sleep(after)
+        self._flowing.clear()
+        await asyncio.sleep(duration)
+        self._flowing.set()
+
+    async def drop_every(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.drop_connections()
+
+
+class FakeMaxApi:
+    """Фальшивый API MAX: /me, /chats/{id}, /messages с задержкой, ошибками и обрывами."""
+
+    def __init__(self, host: str = '127.0.0.1'):
+        self.host = host
+        self.port = None
+        self.runner = None
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.reset_rate = 0.0
+        self.sent = Counter()
+        self.failed = 0
+        self.seq = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/me', self.me)
+        app.router.add_get('/chats/{chat_id}', self.chat)
+        app.router.add_post('/messages', self.messages)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, 0).start()
+        self.port = self.runner.addresses[0][1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def reset(self):
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.reset_rate = 0.0
+
+    def reset_stats(self):
+        self.sent.clear()
+        self.failed = 0
+
+    async def _inject(self, request: web.Request):
+        """Возвращает ответ-ошибку, если запрос должен завершиться отказом."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = random.random()
+        if roll < self.reset_rate:
+            self.failed += 1
+            request.transport.abort()
+            return web.Response()
+        if roll < self.reset_rate + self.error_rate:
+            self.failed += 1
+            return web.json_response({'code': 'internal.error', 'message': 'Injected failure'}, status=500)
+        return None
+
+    async def me(self, request: web.Request) -> web.Response:
+        return web.json_response(BOT_USER)
+
+    async def chat(self, request: web.Request) -> web.Response:
+        failure = await self._inject(request)
+        if failure is not None:
+            return failure
+        return web.json_response({
+            'chat_id': int(request.match_info['chat_id']), 'type': 'dialog', 'status': 'active',
+            'last_event_time': int(time.time() * 1000), 'participants_count': 2, 'is_public': False,
+        })
+
+    async def messages(self, request: web.Request) -> web.Response:
+        failure = await self._inject(request)
+        if failure is not None:
+            return failure
+        chat_id = int(request.query.get('chat_id', 0))
+        payload = await request.json()
+        text = payload.get('text')
+        self.sent[(chat_id, text)] += 1
+        self.seq += 1
+        return web.json_response({'message': {
+            'sender': BOT_USER,
+            'recipient': {'chat_id': chat_id, 'chat_type': 'dialog'},
+            'timestamp': int(time.time() * 1000),
+            'body': {'mid': f'bot.{self.seq}', 'seq': self.seq, 'text': text},
+        }})
+
+
+class ScenarioStats:
+    def __init__(self):
+        self.latencies = []
+        self.loop_lags = []
+        self.delivered = 0
+        self.retries = 0
+        self.redelivered = 0
+        self.abandoned = 0
+        self.completed = []
+
+
+def _user(chat_id: int) -> dict:
+    return {'user_id': chat_id, 'first_name': 'Иван', 'last_name': 'Иванов', 'is_bot': False,
+            'last_activity_time': int(time.time() * 1000)}
+
+
+def _bot_started(chat_id: int) -> dict:
+    return {'update_type': 'bot_started', 'timestamp': int(time.time() * 1000),
+            'chat_id': chat_id, 'user': _user(chat_id)}
+
+
+def _callback(chat_id: int, step: int, payload: str) -> dict:
+    now = int(time.time() * 1000)
+    return {'update_type': 'message_callback', 'timestamp': now,
+            'callback': {'timestamp': now, 'callback_id': f'cb.{chat_id}.{step}', 'payload': payload,
+                         'user': _user(chat_id)},
+            'message': {'sender': BOT_USER, 'recipient': {'chat_id': chat_id, 'chat_type': 'dialog'},
+                        'timestamp': now, 'body': {'mid': f'bot.{chat_id}.{step}', 'seq': step, 'text': ''}}}
+
+
+def _message(chat_id: int, step: int, text: str) -> dict:
+    now = int(time.time() * 1000)
+    return {'update_type': 'message_created', 'timestamp': now,
+            'message': {'sender': _user(chat_id), 'recipient': {'chat_id': chat_id, 'chat_type': 'dialog'},
+                        'timestamp': now, 'body': {'mid': f'mid.{chat_id}.{step}', 'seq': step, 'text': text}}}
+
+
+def registration_flow(bot_module, chat_id: int, phone: str) -> list:
+    """Обновления, которые MAX присылает за полную регистрацию одного пользователя."""
+    return [
+        _bot_started(chat_id),
+        _callback(chat_id, 1, bot_module.CONTINUE_CALLBACK),
+        _callback(chat_id, 2, bot_module.AGREEMENT_CALLBACK),
+        _message(chat_id, 3, "Иванов Иван Иванович"),
+        _message(chat_id, 4, "13.03.2003"),
+        _message(chat_id, 5, phone),
+        _callback(chat_id, 6, bot_module.CONFIRM_DATA_CALLBACK),
+    ]
+
+
+async def deliver(session: ClientSession, url: str, update: dict, stats: ScenarioStats) -> bool:
+    """Доставляет обновление на вебхук, повторяя при ошибке, как MAX."""
+    body = json.dumps(update, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'X-Max-Bot-Api-Secret': CHAOS_SECRET}
+    for attempt in range(DELIVERY_ATTEMPTS):
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=body, headers=headers) as response:
+                status = response.status
+        except (ClientError, asyncio.TimeoutError):
+            status = None
+        stats.latencies.append(time.perf_counter() - started)
+        if status == 200:
+            stats.delivered += 1
+            return True
+        stats.retries += 1
+        await asyncio.sleep(REDELIVERY_DELAY)
+    return False
+
+
+async def simulate_user(session, url, updates, chat_id, config, args, stats, semaphore):
+    # Пользователи приходят не одновременно, а в течение первых секунд сценария
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    async with semaphore:
+        for update in updates:
+            if not await deliver(session, url, update, stats):
+                stats.abandoned += 1
+                return
+            if random.random() < config.get('redelivery_rate', 0.0):
+                # MAX гарантирует доставку "хотя бы раз" - то же обновление может прийти снова
+                stats.redelivered += 1
+                await deliver(session, url, update, stats)
+            # Пауза пользователя: бот отбрасывает нажатия чаще раза в секунду
+            await asyncio.sleep(args.think_time)
+        stats.completed.append(chat_id)
+
+
+async def monitor_loop_lag(stats: ScenarioStats, interval: float = 0.05):
+    """Измеряет, насколько синхронные вызовы БД задерживают цикл событий бота."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lags.append(time.perf_counter() - started - interval)
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_scenario(name: str, index: int, args, faults: FaultLoop, proxy: FaultProxy,
+                       api: FakeMaxApi, bot_module, webhook_url: str) -> dict:
+    config = SCENARIOS[name]
+    stats = ScenarioStats()
+    api.reset_stats()
+
+    # Включаем отказы
+    proxy.latency = config.get('db_latency', 0.0)
+    api.latency = config.get('api_latency', 0.0)
+    api.error_rate = config.get('api_error_rate', 0.0)
+    api.reset_rate = config.get('api_reset_rate', 0.0)
+    # Отказ и зависание базы конечны - их окончания дожидаемся, чтобы измерить восстановление
+    finite = []
+    scheduled = []
+    if 'db_outage' in config:
+        finite.append(faults.submit(proxy.outage(*config['db_outage'])))
+    if 'db_stall' in config:
+        finite.append(faults.submit(proxy.stall(*config['db_stall'])))
+    if 'db_drop_interval' in config:
+        scheduled.append(faults.submit(proxy.drop_every(config['db_drop_interval'])))
+
+    # У каждого сценария свои chat_id и телефоны (+79SSNNNNNNN)
+    chat_ids = [(index + 1) * 1000000 + i for i in range(args.users)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    monitor = asyncio.create_task(monitor_loop_lag(stats))
+    started = time.perf_counter()
+    async with ClientSession(timeout=ClientTimeout(total=DELIVERY_TIMEOUT)) as session:
+        await asyncio.gather(*(
+            simulate_user(session, webhook_url,
+                          registration_flow(bot_module, chat_id, f"+79{index:02d}{i:07d}"),
+                          chat_id, config, args, stats, semaphore)
+            for i, chat_id in enumerate(chat_ids)
+        ))
+    elapsed = time.perf_counter() - started
+
+    # Время от окончания отказа до первого успешного запроса бота к базе
+    for future in finite:
+        await asyncio.wrap_future(future)
+    fault_ended = time.monotonic()
+    deadline = fault_ended + args.settle_timeout
+    while not bot_module.db.ping() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    recovery = time.monotonic() - fault_ended
+    monitor.cancel()
+
+    # Выключаем отказы и ждем, пока отложенные регистрации дойдут до базы
+    for future in scheduled:
+        future.cancel()
+    faults.call(proxy.reset)
+    api.reset()
+    while bot_module.db.pending_registrations and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+
+    registered = admin_execute(
+        f"SELECT count(*) FROM {CHAOS_SCHEMA}.users WHERE chat_id = ANY(%s)",
+        ([str(chat_id) for chat_id in stats.completed],)
+    )[0]
+    duplicates = sum(count - 1 for count in api.sent.values() if count > 1)
+
+    result = {
+        'updates/s': stats.delivered / elapsed if elapsed else 0.0,
+        'p50 ms': _percentile(stats.latencies, 0.5) * 1000,
+        'p95 ms': _percentile(stats.latencies, 0.95) * 1000,
+        'max ms': max(stats.latencies, default=0.0) * 1000,
+        'loop lag max ms': max(stats.loop_lags, default=0.0) * 1000,
+        'recovery ms': recovery * 1000,
+        'webhook retries': stats.retries,
+        'redelivered': stats.redelivered,
+        'abandoned flows': stats.abandoned,
+        'api failures': api.failed,
+        'messages sent': sum(api.sent.values()),
+        'duplicate sends': duplicates,
+        'completed flows': len(stats.completed),
+        'lost registrations': len(stats.completed) - registered,
+    }
+
+    failures = []
+    if result['p95 ms'] > config['p95'] * 1000:
+        failures.append(f"p95 {result['p95 ms']:.0f} ms > {config['p95'] * 1000:.0f} ms")
+    if 'max_loop_lag' in config and result['loop lag max ms'] > config['max_loop_lag'] * 1000:
+        failures.append(f"loop lag {result['loop lag max ms']:.0f} ms > {config['max_loop_lag'] * 1000:.0f} ms")
+    if 'recovery' in config and result['recovery ms'] > config['recovery'] * 1000:
+        failures.append(f"recovery {result['recovery ms']:.0f} ms > {config['recovery'] * 1000:.0f} ms")
+    if duplicates > config.get('max_duplicates', 0):
+        failures.append(f"duplicate sends {duplicates} > {config.get('max_duplicates', 0)}")
+    if result['lost registrations'] > config.get('max_lost', 0):
+        failures.append(f"lost registrations {result['lost registrations']} > {config.get('max_lost', 0)}")
+    result['failures'] = failures
+    return result
+
+
+async def run(args) -> int:
+    faults = FaultLoop()
+    proxy = FaultProxy(DB_HOST, int(DB_PORT))
+    api = FakeMaxApi()
+    faults.run(proxy.start())
+    faults.run(api.start())
+
+    # Бот работает с отдельной схемой через прокси; настройки нужны до импорта бота
+    use_scratch_schema(CHAOS_SCHEMA)
+    os.environ['DB_HOST'] = proxy.host
+    os.environ['DB_PORT'] = str(proxy.port)
+    os.environ.setdefault("MAXAPI_TOKEN", "chaos-check")
+
+    import bot_1_win11
+    from funnel_events import FunnelEventLog
+    from tenants import Tenant, register_tenant
+    from webhook_server import WebhookServer
+
+    # События воронки не должны попасть в рабочий файл
+    bot_1_win11.funnel_log = FunnelEventLog(os.path.join(tempfile.mkdtemp(), 'funnel_events.bin'))
+    bot = bot_1_win11.bot
+    bot.set_api_url(api.url)
+    register_tenant(Tenant('chaos', bot, bot_1_win11.dp, webhook_url=''))
+
+    webhook_server = WebhookServer(host='127.0.0.1', port=args.webhook_port, secret=CHAOS_SECRET,
+                                   lifecycle=bot_1_win11.lifecycle)
+    webhook_server.add_route('/', bot, bot_1_win11.dp)
+    await webhook_server.start()
+    supervisor = asyncio.create_task(bot_1_win11.db.run_supervisor(interval=0.5))
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}/"
+
+    results = {}
+    try:
+        for index, name in enumerate(args.scenarios):
+            print(f"Running {name}...", flush=True)
+            results[name] = await run_scenario(name, index, args, faults, proxy, api, bot_1_win11, webhook_url)
+    finally:
+        supervisor.cancel()
+        await webhook_server.stop()
+        if bot.session:
+            await bot.session.close()
+        bot_1_win11.db.close_connection()
+        faults.run(api.stop())
+        faults.stop()
+        drop_scratch_schema(CHAOS_SCHEMA, keep=args.keep_schema)
+
+    names = list(results)
+    print(f"\n{args.users} users per scenario")
+    print(f"{'':<20}" + "".join(f"{name:>15}" for name in names))
+    for metric in results[names[0]]:
+        if metric == 'failures':
+            continue
+        print(f"{metric:<20}" + "".join(f"{results[name][metric]:>15.0f}" for name in names))
+
+    failed = 0
+    for name in names:
+        for failure in results[name]['failures']:
+            print(f"FAIL {name}: {failure}")
+            failed += 1
+    print("OK" if not failed else f"{failed} check(s) failed")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка поведения бота при отказах БД и API MAX")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=100, help="Пользователей в каждом сценарии")
+    parser.add_argument('--concurrency', type=int, default=100, help="Одновременно регистрирующихся")
+    parser.add_argument('--ramp', type=float, default=2.0, help="Время прихода пользователей, сек")
+    parser.add_argument('--think-time', type=float, default=1.1, help="Пауза пользователя между шагами, сек")
+    parser.add_argument('--settle-timeout', type=float, default=30.0,
+                        help="Ожидание записи отложенных регистраций после сценария, сек")
+    parser.add_argument('--webhook-port', type=int, default=18080)
+    parser.add_argument('--keep-schema', action='store_true', help="Не удалять схему с данными проверки")
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+# funnel_events.py
+import argparse
+import asyncio
+import atexit
+import logging
+import os
+import struct
+import time
+from datetime import datetime
+
+# Коды событий воронки регистрации
+EVENT_BOT_STARTED = 1
+EVENT_CONTINUE = 2
+EVENT_AGREEMENT = 3
+EVENT_FIO_ENTERED = 4
+EVENT_BIRTH_DATE_ENTERED = 5
+EVENT_PHONE_ENTERED = 6
+EVENT_CORRECT_FIO = 7
+EVENT_CORRECT_BIRTH_DATE = 8
+EVENT_CORRECT_PHONE = 9
+EVENT_CONFIRM_REQUESTED = 10
+EVENT_CONFIRMED = 11
+EVENT_REGISTRATION_FAILED = 12
+EVENT_RESTARTED = 13
+
+EVENT_NAMES = {
+    EVENT_BOT_STARTED: 'bot_started',
+    EVENT_CONTINUE: 'continue',
+    EVENT_AGREEMENT: 'agreement',
+    EVENT_FIO_ENTERED: 'fio_entered',
+    EVENT_BIRTH_DATE_ENTERED: 'birth_date_entered',
+    EVENT_PHONE_ENTERED: 'phone_entered',
+    EVENT_CORRECT_FIO: 'correct_fio',
+    EVENT_CORRECT_BIRTH_DATE: 'correct_birth_date',
+    EVENT_CORRECT_PHONE: 'correct_phone',
+    EVENT_CONFIRM_REQUESTED: 'confirm_requested',
+    EVENT_CONFIRMED: 'confirmed',
+    EVENT_REGISTRATION_FAILED: 'registration_failed',
+    EVENT_RESTARTED: 'restarted',
+}
+
+# Коды состояний FSM; 0 - состояние не изменилось
+STATE_CODES = {
+    'new': 1,
+    'agreement_shown': 2,
+    'waiting_fio': 3,
+    'waiting_birth_date': 4,
+    'waiting_phone': 5,
+    'waiting_confirmation': 6,
+    'registered': 7,
+    'failed': 8,
+}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+# Состояние FSM после события по умолчанию (None - зависит от введенных данных)
+EVENT_STATES = {
+    EVENT_BOT_STARTED: 'new',
+    EVENT_CONTINUE: 'agreement_shown',
+    EVENT_AGREEMENT: 'waiting_fio',
+    EVENT_FIO_ENTERED: None,
+    EVENT_BIRTH_DATE_ENTERED: None,
+    EVENT_PHONE_ENTERED: 'waiting_confirmation',
+    EVENT_CORRECT_FIO: 'waiting_fio',
+    EVENT_CORRECT_BIRTH_DATE: 'waiting_birth_date',
+    EVENT_CORRECT_PHONE: 'waiting_phone',
+    EVENT_CONFIRM_REQUESTED: None,
+    EVENT_CONFIRMED: 'registered',
+    EVENT_REGISTRATION_FAILED: 'failed',
+    EVENT_RESTARTED: 'waiting_fio',
+}
+
+# Формат записи: время (double), chat_id (int64), код события (uint8), код состояния (uint8)
+RECORD = struct.Struct('<dqBB')
+FILE_MAGIC = b'FNL1'
+
+EVENTS_FILE = os.path.join('logs', 'funnel_events.bin')
+
+
+class FunnelEventLog:
+    """Поток событий воронки с пакетной записью в append-only файл.
+
+    Записи упаковываются в заранее выделенный буфер фиксированного размера
+    и сбрасываются на диск целиком: при заполнении буфера или по таймеру. При падении
+    процесса теряется не больше flush_interval секунд или capacity событий.
+    """
+
+    def __init__(self, path: str = EVENTS_FILE, capacity: int = 4096, flush_interval: float = 1.0):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.buffer = bytearray(RECORD.size * capacity)
+        self.count = 0
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    def append(self, chat_id, event: int, state: str = None, timestamp: float = None):
+        """Добавляет событие в буфер. Не выполняет ввод-вывод, пока буфер не заполнен.
+
+        state - состояние FSM после перехода (имя или код), если оно не следует из самого события.
+        """
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            self.dropped += 1
+            return
+
+        RECORD.pack_into(self.buffer, self.count * RECORD.size,
+                         timestamp or time.time(), chat_id, event,
+                         state if isinstance(state, int) else STATE_CODES.get(state, 0))
+        self.count += 1
+        if self.count >= self.capacity:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Дописывает накопленные события в файл."""
+        if not self.count:
+            return True
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'ab') as f:
+                if is_new:
+                    f.write(FILE_MAGIC)
+                f.write(memoryview(self.buffer)[:self.count * RECORD.size])
+                f.flush()
+                os.fsync(f.fileno())
+            self.count = 0
+            return True
+        except OSError as e:
+            logging.error(f"ERROR: Failed to flush funnel events, Error: {str(e)}")
+            # Буфер полон и записать некуда - отбрасываем старые события
+            if self.count >= self.capacity:
+                self.dropped += self.count
+                self.count = 0
+            return False
+
+    async def run_flusher(self):
+        """Периодически сбрасывает буфер событий на диск."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+
+def read_events(path: str = EVENTS_FILE):
+    """Читает события из файла. Недописанная последняя запись пропускается."""
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path}: не файл событий воронки")
+        data = f.read()
+
+    usable = len(data) - len(data) % RECORD.size
+    yield from RECORD.iter_unpack(memoryview(data)[:usable])
+
+
+def replay_histories(events, chat_id: int = None) -> dict:
+    """Восстанавливает историю переходов FSM по каждому пользователю."""
+    histories = {}
+    states = {}
+    for timestamp, event_chat_id, event, state_code in events:
+        if chat_id is not None and event_chat_id != chat_id:
+            continue
+        state = (STATE_NAMES.get(state_code) or EVENT_STATES.get(event)
+                 or states.get(event_chat_id, 'unknown'))
+        states[event_chat_id] = state
+        histories.setdefault(event_chat_id, []).append(
+            (timestamp, EVENT_NAMES.get(event, f'event_{event}'), state)
+        )
+    return histories
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение истории воронки регистрации")
+    parser.add_argument('--file', default=EVENTS_FILE)
+    parser.add_argument('--chat-id', type=int, default=None)
+    parser.add_argument('--summary', action='store_true', help="Только итоговое состояние пользователей")
+    args = parser.parse_args()
+
+    histories = replay_histories(read_events(args.file), args.chat_id)
+
+    if args.summary:
+        totals = {}
+        for history in histories.values():
+            final_state = history[-1][2]
+            totals[final_state] = totals.get(final_state, 0) + 1
+        for state, users in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"{state:<22} {users}")
+        return 0
+
+    for event_chat_id, history in histories.items():
+        print(f"User {event_chat_id}:")
+        for timestamp, event_name, state in history:
+            moment = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"  [{moment}] {event_name:<20} -> {state}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+# funnel_stats.py
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import psycopg2
+
+# Этапы воронки регистрации в порядке прохождения
+FUNNEL_STAGES = ('bot_started', 'agreement', 'fio', 'birth_date', 'phone', 'confirmed')
+_STAGE_INDEX = {stage: index for index, stage in enumerate(FUNNEL_STAGES)}
+
+# Возрастные группы: (нижняя граница включительно, название)
+AGE_GROUPS = ((0, '0-17'), (18, '18-29'), (30, '30-44'), (45, '45-59'), (60, '60-74'), (75, '75+'))
+
+# Ограничение на число незавершенных регистраций, которые мы отслеживаем
+MAX_TRACKED_USERS = 100000
+
+
+def age_group(birth_date: str, today: date = None) -> str:
+    """Возвращает возрастную группу по дате рождения в формате ДД.ММ.ГГГГ."""
+    today = today or date.today()
+    try:
+        day, month, year = map(int, birth_date.split('.'))
+        born = date(year, month, day)
+    except (ValueError, AttributeError):
+        return 'unknown'
+
+    age = today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+    group = 'unknown'
+    for lower_bound, name in AGE_GROUPS:
+        if age >= lower_bound:
+            group = name
+    return group
+
+
+class FunnelStats:
+    """Инкрементально обновляемые агрегаты воронки регистрации.
+
+    Обработчики бота сообщают о прохождении этапов через advance(); счетчики
+    копятся в памяти и периодически сбрасываются в таблицы агрегатов одним
+    UPSERT-ом. Отчеты читают только агрегаты и не трогают таблицу users.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.pending_stages = Counter()
+        self.pending_ages = Counter()
+        self.reached = {}
+        self._init_tables()
+
+    def _init_tables(self):
+        """Создает таблицы агрегатов, если они не существуют."""
+        conn = self.database.connection()
+        if not conn:
+            return
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS stats_funnel_daily (
+                    day DATE NOT NULL,
+                    stage VARCHAR(32) NOT NULL,
+                    users INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, stage)
+                );
+                """)
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS stats_age_distribution (
+                    age_group VARCHAR(16) PRIMARY KEY,
+                    users INTEGER NOT NULL DEFAULT 0
+                );
+                """)
+            conn.commit()
+            logging.info("INFO: Таблицы статистики воронки проверены/созданы.")
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Ошибка при инициализации таблиц статистики: {e}")
+            self.database.recover(e)
+
+    def advance(self, chat_id: str, stage: str, birth_date: str = None):
+        """Учитывает прохождение этапа воронки пользователем.
+
+        Каждый этап засчитывается пользователю один раз: повторный ввод данных
+        при исправлении не увеличивает счетчики.
+        """
+        index = _STAGE_INDEX[stage]
+        if self.reached.get(chat_id, -1) >= index:
+            return
+
+        if stage == 'confirmed':
+            # Регистрация завершена - больше не отслеживаем пользователя
+            self.reached.pop(chat_id, None)
+            self.pending_ages[age_group(birth_date)] += 1
+        else:
+            if chat_id not in self.reached and len(self.reached) >= MAX_TRACKED_USERS:
+                # Выбрасываем самую старую брошенную регистрацию
+                self.reached.pop(next(iter(self.reached)))
+            self.reached[chat_id] = index
+
+        self.pending_stages[(date.today(), stage)] += 1
+
+    def forget(self, chat_id: str):
+        """Перестает отслеживать пользователя (например, после удаления из базы)."""
+        self.reached.pop(chat_id, None)
+
+    def flush(self) -> bool:
+        """Сбрасывает накопленные счетчики в таблицы агрегатов."""
+        if not self.pending_stages and not self.pending_ages:
+            return True
+
+        conn = self.database.connection()
+        if not conn:
+            return False
+
+        stages, ages = self.pending_stages, self.pending_ages
+        self.pending_stages, self.pending_ages = Counter(), Counter()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.executemany("""
+                INSERT INTO stats_funnel_daily (day, stage, users) VALUES (%s, %s, %s)
+                ON CONFLICT (day, stage) DO UPDATE SET users = stats_funnel_daily.users + EXCLUDED.users
+                """, [(day, stage, count) for (day, stage), count in stages.items()])
+                cursor.executemany("""
+                INSERT INTO stats_age_distribution (age_group, users) VALUES (%s, %s)
+                ON CONFLICT (age_group) DO UPDATE SET users = stats_age_distribution.users + EXCLUDED.users
+                """, list(ages.items()))
+            conn.commit()
+            return True
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to flush funnel stats, Error: {str(e)}")
+            self.database.recover(e)
+            # Возвращаем счетчики, чтобы не потерять их до следующей попытки
+            stages.update(self.pending_stages)
+            ages.update(self.pending_ages)
+            self.pending_stages, self.pending_ages = stages, ages
+            return False
+
+    async def run_flusher(self, interval: float = 10.0):
+        """Периодически сбрасывает счетчики в базу данных."""
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def rebuild_from_users(self):
+        """Пересчитывает регистрации и возрастные группы по таблице users.
+
+        Полный проход по users - только для первоначального заполнения
+        агрегатов, в рабочем режиме не используется.
+        """
+        conn = self.database.connection()
+        if not conn:
+            return
+
+        try:
+            with conn.cursor(name='stats_rebuild') as cursor:
+                cursor.itersize = 10000
+                if self.database.cipher:
+                    cursor.execute("SELECT birth_date, birth_date_enc, registration_date FROM users")
+                else:
+                    cursor.execute("SELECT birth_date, NULL, registration_date FROM users")
+                registrations, ages = Counter(), Counter()
+                for birth_date, birth_date_enc, registration_date in cursor:
+                    registrations[registration_date[:10]] += 1
+                    ages[age_group(self.database.read_field(birth_date, birth_date_enc, 'birth_date'))] += 1
+
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM stats_funnel_daily WHERE stage = 'confirmed'")
+                cursor.execute("DELETE FROM stats_age_distribution")
+                cursor.executemany(
+                    "INSERT INTO stats_funnel_daily (day, stage, users) VALUES (%s, 'confirmed', %s)",
+                    list(registrations.items())
+                )
+                cursor.executemany(
+                    "INSERT INTO stats_age_distribution (age_group, users) VALUES (%s, %s)",
+                    list(ages.items())
+                )
+            conn.commit()
+            logging.info(f"INFO: Агрегаты пересчитаны по таблице users: {sum(registrations.values())} регистраций.")
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to rebuild funnel stats, Error: {str(e)}")
+            self.database.recover(e)
+
+    # --- Отчеты (читают только таблицы агрегатов) ---
+    # Если база недоступна, отчет пустой; причина - в журнале и в database.status()
+
+    def _report(self, name: str, query: str, params: tuple = ()) -> list:
+        conn = self.database.connection()
+        if not conn:
+            return []
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to build {name} report, Error: {str(e)}")
+            self.database.recover(e)
+            return []
+
+    def daily_registrations(self, days: int = 14) -> list:
+        """Возвращает число регистраций по дням за последние days дней."""
+        since = date.today() - timedelta(days=days - 1)
+        return self._report(
+            'daily registrations',
+            "SELECT day, users FROM stats_funnel_daily WHERE stage = 'confirmed' AND day >= %s ORDER BY day",
+            (since,)
+        )
+
+    def funnel(self, days: int = 30) -> list:
+        """Возвращает число пользователей на каждом этапе воронки за период."""
+        since = date.today() - timedelta(days=days - 1)
+        rows = self._report(
+            'funnel',
+            "SELECT stage, SUM(users) FROM stats_funnel_daily WHERE day >= %s GROUP BY stage",
+            (since,)
+        )
+        if not rows and not self.database.is_available():
+            return []
+        totals = dict(rows)
+        return [(stage, int(totals.get(stage, 0))) for stage in FUNNEL_STAGES]
+
+    def age_distribution(self) -> list:
+        """Возвращает распределение зарегистрированных пользователей по возрасту."""
+        totals = dict(self._report('age distribution', "SELECT age_group, users FROM stats_age_distribution"))
+        groups = [name for _, name in AGE_GROUPS] + ['unknown']
+        return [(group, totals.get(group, 0)) for group in groups if group in totals]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчеты по воронке регистрации")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    daily_parser = subparsers.add_parser('daily', help="Регистрации по дням")
+    daily_parser.add_argument('--days', type=int, default=14)
+
+    funnel_parser = subparsers.add_parser('funnel', help="Воронка регистрации")
+    funnel_parser.add_argument('--days', type=int, default=30)
+
+    subparsers.add_parser('ages', help="Распределение по возрасту")
+    subparsers.add_parser('rebuild', help="Пересчитать агрегаты по таблице users")
+
+    args = parser.parse_args()
+
+    from user_database import db
+
+    if not db.conn:
+        print("Нет подключения к базе данных")
+        return 1
+
+    if args.command == 'rebuild':
+        # Полный проход по users может идти дольше ограничения для запросов бота
+        db.set_query_timeout(None)
+    stats = FunnelStats(db)
+    started = time.perf_counter()
+
+    if args.command == 'daily':
+        for day, users in stats.daily_registrations(args.days):
+            print(f"{day.isoformat()}  {users}")
+
+    elif args.command == 'funnel':
+        previous = None
+        for stage, users in stats.funnel(args.days):
+            drop = ""
+            if previous:
+                drop = f"  (-{100 - users * 100 / previous:.1f}%)"
+            print(f"{stage:<12} {users}{drop}")
+            previous = users
+
+    elif args.command == 'ages':
+        for group, users in stats.age_distribution():
+            print(f"{group:<8} {users}")
+
+    elif args.command == 'rebuild':
+        stats.rebuild_from_users()
+
+    if not db.is_available():
+        print(f"База данных недоступна: {db.status()['last_error']}")
+        return 1
+
+    print(f"\n({(time.perf_counter() - started) * 1000:.1f} мс)")
+    db.close_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
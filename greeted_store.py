@@ -0,0 +1,181 @@
+# greeted_store.py
+import asyncio
+import os
+import struct
+import time
+from array import array
+
+from logging_config import log_bot_event, log_error
+
+GREETED_FILE = os.path.join('state', 'greeted_chats.bin')
+
+_EMPTY = 0
+_DELETED = -2 ** 63
+_HEADER = struct.Struct('<4sIII')
+_FILE_MAGIC = b'GRT1'
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_MAX_LOAD = 0.75
+_MIN_SIZE = 1024
+
+
+def _today() -> int:
+    """Номер текущего дня от начала эпохи."""
+    return int(time.time() // 86400)
+
+
+class GreetedChats:
+    """Компактное множество chat_id, которым уже отправлено приветствие.
+
+    Открытая адресация поверх двух массивов: chat_id (int64) и день последнего
+    приветствия (uint16) - 10 байт на слот, в среднем 15-25 байт на чат.
+    Проверка и добавление выполняются за O(1). Записи старше ttl_days дней
+    считаются отсутствующими и удаляются при перестроении таблицы.
+    """
+
+    def __init__(self, ttl_days: int = 90, capacity: int = _MIN_SIZE):
+        self.ttl_days = ttl_days
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        size = _MIN_SIZE
+        while size < capacity:
+            size <<= 1
+        self.keys = array('q', bytes(8 * size))
+        self.days = array('H', bytes(2 * size))
+        self.mask = size - 1
+        self.shift = 64 - (size.bit_length() - 1)
+        self.count = 0
+        self.used = 0
+        self.dirty = False
+
+    def _slot(self, key: int) -> int:
+        """Возвращает слот с ключом или первый пустой слот на пути поиска."""
+        index = ((key * _HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+        keys = self.keys
+        mask = self.mask
+        first_deleted = -1
+        while True:
+            current = keys[index]
+            if current == key:
+                return index
+            if current == _EMPTY:
+                return first_deleted if first_deleted >= 0 else index
+            if current == _DELETED and first_deleted < 0:
+                first_deleted = index
+            index = (index + 1) & mask
+
+    def _is_fresh(self, day: int, today: int) -> bool:
+        return today - day <= self.ttl_days
+
+    def __contains__(self, chat_id) -> bool:
+        key = int(chat_id)
+        index = self._slot(key)
+        return self.keys[index] == key and self._is_fresh(self.days[index], _today())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, chat_id, day: int = None):
+        """Добавляет chat_id или обновляет дату его приветствия."""
+        key = int(chat_id)
+        if key in (_EMPTY, _DELETED):
+            return
+
+        index = self._slot(key)
+        if self.keys[index] != key:
+            if self.keys[index] == _EMPTY:
+                self.used += 1
+            self.keys[index] = key
+            self.count += 1
+        self.days[index] = day if day is not None else _today()
+        self.dirty = True
+
+        size = self.mask + 1
+        if self.used > size * _MAX_LOAD:
+            # Много удаленных слотов - достаточно перестроить таблицу того же размера
+            self._rebuild(size * 2 if self.count > size * _MAX_LOAD / 2 else size)
+
+    def discard(self, chat_id):
+        """Удаляет chat_id из множества."""
+        key = int(chat_id)
+        index = self._slot(key)
+        if self.keys[index] == key:
+            self.keys[index] = _DELETED
+            self.count -= 1
+            self.dirty = True
+
+    def _entries(self):
+        for key, day in zip(self.keys, self.days):
+            if key != _EMPTY and key != _DELETED:
+                yield key, day
+
+    def _rebuild(self, size: int):
+        """Перестраивает таблицу, отбрасывая удаленные и устаревшие записи."""
+        today = _today()
+        entries = [(key, day) for key, day in self._entries() if self._is_fresh(day, today)]
+        self._allocate(size)
+        for key, day in entries:
+            self.add(key, day)
+
+    def expire(self):
+        """Удаляет записи старше ttl_days дней."""
+        cutoff = _today() - self.ttl_days
+        if all(day >= cutoff for _, day in self._entries()):
+            return
+
+        before = self.count
+        self._rebuild(int(self.count / _MAX_LOAD) + 1)
+        if before != self.count:
+            log_bot_event("Greeted chats expired", f"Removed: {before - self.count}")
+
+    def save(self, path: str = GREETED_FILE) -> bool:
+        """Атомарно сохраняет таблицу в двоичный файл."""
+        tmp_path = path + '.tmp'
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(_FILE_MAGIC, self.mask + 1, self.count, self.used))
+                self.keys.tofile(f)
+                self.days.tofile(f)
+            os.replace(tmp_path, path)
+            self.dirty = False
+            return True
+        except OSError as e:
+            log_error("Failed to save greeted chats", f"Error: {str(e)}")
+            return False
+
+    def load(self, path: str = GREETED_FILE) -> bool:
+        """Загружает таблицу из файла и удаляет устаревшие записи."""
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with open(path, 'rb') as f:
+                magic, size, count, used = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _FILE_MAGIC or size & (size - 1):
+                    raise ValueError("неверный формат файла")
+                keys = array('q')
+                keys.fromfile(f, size)
+                days = array('H')
+                days.fromfile(f, size)
+        except (OSError, EOFError, ValueError, struct.error) as e:
+            log_error("Failed to load greeted chats", f"Error: {str(e)}")
+            return False
+
+        self.keys, self.days = keys, days
+        self.mask = size - 1
+        self.shift = 64 - (size.bit_length() - 1)
+        self.count, self.used = count, used
+        self.expire()
+        log_bot_event("Greeted chats loaded", f"Count: {self.count}")
+        return True
+
+    async def run_saver(self, path: str = GREETED_FILE, interval: float = 60.0):
+        """Периодически сохраняет таблицу на диск."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.dirty:
+                self.save(path)
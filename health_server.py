@@ -0,0 +1,53 @@
+# health_server.py
+import os
+import time
+
+from aiohttp import web
+
+from logging_config import log_bot_event
+
+HEALTH_HOST = os.getenv("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8081"))
+
+
+class HealthServer:
+    """HTTP-эндпоинты для проверок живости и готовности бота.
+
+    /healthz - процесс жив и цикл событий отвечает;
+    /readyz  - бот готов обслуживать пользователей (база данных доступна).
+    """
+
+    def __init__(self, database, host: str = HEALTH_HOST, port: int = HEALTH_PORT):
+        self.database = database
+        self.host = host
+        self.port = port
+        self.started_at = time.time()
+        self.runner = None
+
+    async def liveness(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'alive', 'uptime': round(time.time() - self.started_at)})
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        db_status = self.database.status()
+        ready = db_status['available']
+        return web.json_response(
+            {'status': 'ready' if ready else 'degraded', 'database': db_status},
+            status=200 if ready else 503
+        )
+
+    async def start(self):
+        """Запускает HTTP-сервер проверок."""
+        app = web.Application()
+        app.router.add_get('/healthz', self.liveness)
+        app.router.add_get('/readyz', self.readiness)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log_bot_event("Health server started", f"Port: {self.port}")
+
+    async def stop(self):
+        """Останавливает HTTP-сервер проверок."""
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
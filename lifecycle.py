@@ -0,0 +1,168 @@
+# lifecycle.py
+import asyncio
+import functools
+import gzip
+import json
+import os
+import signal
+import time
+
+from logging_config import log_bot_event, log_error, log_warning
+
+SNAPSHOT_FILE = os.path.join('state', 'snapshot.json.gz')
+SNAPSHOT_VERSION = 6
+
+
+class BotLifecycle:
+    """Управление жизненным циклом бота: сигналы, остановка и снимок состояния.
+
+    При получении SIGTERM/SIGINT бот перестает брать новые обновления, ждет
+    завершения уже запущенных обработчиков (не дольше drain_timeout секунд)
+    и сохраняет состояние в памяти в сжатый файл, чтобы после перезапуска
+    пользователи продолжили регистрацию с того же шага.
+    """
+
+    def __init__(self, snapshot_path: str = SNAPSHOT_FILE, drain_timeout: float = 10.0,
+                 snapshot_max_age: float = 24 * 3600):
+        self.snapshot_path = snapshot_path
+        self.drain_timeout = drain_timeout
+        self.snapshot_max_age = snapshot_max_age
+        self.accepting = True
+        self.in_flight = 0
+        self._idle = None
+        self._shutdown = None
+
+    def _events(self):
+        # События создаются лениво, чтобы привязаться к работающему циклу
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._shutdown = asyncio.Event()
+
+    def begin(self) -> bool:
+        """Учитывает принятое обновление как выполняющуюся работу.
+
+        Возвращает False, если бот уже останавливается: обновление нужно
+        отклонить (503), чтобы MAX доставил его повторно.
+        """
+        self._events()
+        if not self.accepting:
+            return False
+        self._start()
+        return True
+
+    def end(self):
+        """Отмечает завершение работы, начатой begin()."""
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._idle.set()
+
+    def _start(self):
+        self.in_flight += 1
+        self._idle.clear()
+
+    def tracked(self, handler):
+        """Декоратор обработчика: учитывает его как выполняющуюся работу.
+
+        Обновление, дошедшее до обработчика, уже принято и подтверждается
+        ответом 200, поэтому во время остановки обработчик не пропускается,
+        а выполняется до конца в пределах drain_timeout.
+        """
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            self._events()
+            self._start()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                self.end()
+
+        return wrapper
+
+    def request_shutdown(self, reason: str = "signal"):
+        """Запрашивает остановку бота."""
+        self._events()
+        if not self._shutdown.is_set():
+            log_bot_event("Shutdown requested", f"Reason: {reason}")
+            self._shutdown.set()
+
+    def install_signal_handlers(self):
+        """Подписывается на SIGTERM и SIGINT."""
+        self._events()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except NotImplementedError:
+                # Windows: add_signal_handler не поддерживается
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(
+                    self.request_shutdown, signal.Signals(signum).name))
+
+    async def run_until_shutdown(self, server_task: asyncio.Task):
+        """Ждет запроса на остановку или завершения сервера."""
+        self._events()
+        shutdown_waiter = asyncio.create_task(self._shutdown.wait())
+        await asyncio.wait({server_task, shutdown_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        shutdown_waiter.cancel()
+
+        if server_task.done():
+            # Сервер завершился сам - пробрасываем его ошибку, если она была
+            server_task.result()
+
+    async def drain(self) -> bool:
+        """Перестает принимать обновления и ждет завершения текущих обработчиков."""
+        self._events()
+        self.accepting = False
+        if self.in_flight:
+            log_bot_event("Draining in-flight handlers", f"Count: {self.in_flight}")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            log_warning("Drain deadline exceeded", f"Handlers still running: {self.in_flight}")
+            return False
+
+    def save_snapshot(self, state: dict) -> bool:
+        """Атомарно сохраняет состояние в сжатый JSON-файл."""
+        snapshot = {'version': SNAPSHOT_VERSION, 'saved_at': time.time(), 'state': state}
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+            log_bot_event("State snapshot saved", f"File: {self.snapshot_path}")
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            log_error("Failed to save state snapshot", f"Error: {str(e)}")
+            return False
+
+    def load_snapshot(self) -> dict:
+        """Загружает снимок состояния. Устаревший или поврежденный снимок игнорируется."""
+        if not os.path.exists(self.snapshot_path):
+            return {}
+
+        try:
+            with gzip.open(self.snapshot_path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            log_error("Failed to load state snapshot", f"Error: {str(e)}")
+            return {}
+
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            log_warning("State snapshot ignored", f"Unsupported version: {snapshot.get('version')}")
+            return {}
+
+        age = time.time() - snapshot.get('saved_at', 0)
+        if age > self.snapshot_max_age:
+            log_warning("State snapshot ignored", f"Too old: {age:.0f}s")
+            return {}
+
+        # Снимок применяется один раз, чтобы не восстановить его повторно после сбоя
+        os.remove(self.snapshot_path)
+        log_bot_event("State snapshot loaded", f"Age: {age:.0f}s")
+        return snapshot.get('state', {})
@@ -0,0 +1,177 @@
+# log_archive.py
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Размер несжатого блока: каждый блок сжимается отдельно и читается независимо
+BLOCK_SIZE = 64 * 1024
+INDEX_SUFFIX = '.idx'
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# chat_id пользователей в строках логов: "User 123: ...", "User 123, ..."
+USER_PATTERN = re.compile(rb'User (-?\d+)')
+
+
+def _compress_block(data: bytes, method: str) -> bytes:
+    if method == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress_block(data: bytes, method: str) -> bytes:
+    if method == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def compress_with_index(path: str, method: str = 'gzip') -> str:
+    """Сжимает файл лога независимыми блоками и строит индекс chat_id -> блоки.
+
+    Результат - корректный многокомпонентный gzip (или поток кадров zstd),
+    который читается обычными утилитами, и файл индекса рядом с ним.
+    """
+    archive_path = path + EXTENSIONS[method]
+    blocks = []
+    users = {}
+    offset = 0
+
+    with open(path, 'rb') as source, open(archive_path + '.tmp', 'wb') as target:
+        while True:
+            data = source.read(BLOCK_SIZE)
+            if not data:
+                break
+            # Блок заканчивается на границе строки
+            if not data.endswith(b'\n'):
+                data += source.readline()
+
+            block_number = len(blocks)
+            for chat_id in set(USER_PATTERN.findall(data)):
+                users.setdefault(chat_id.decode(), []).append(block_number)
+
+            compressed = _compress_block(data, method)
+            target.write(compressed)
+            blocks.append((offset, len(compressed)))
+            offset += len(compressed)
+
+    index = {'method': method, 'archive': os.path.basename(archive_path), 'blocks': blocks, 'users': users}
+    with open(archive_path + INDEX_SUFFIX + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+    os.replace(archive_path + '.tmp', archive_path)
+    os.replace(archive_path + INDEX_SUFFIX + '.tmp', archive_path + INDEX_SUFFIX)
+    os.remove(path)
+    return archive_path
+
+
+class LogCompressor:
+    """Фоновый поток, сжимающий и индексирующий ротированные логи."""
+
+    def __init__(self, method: str = 'gzip'):
+        if method == 'zstd' and zstandard is None:
+            method = 'gzip'
+        self.method = method
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._worker, name='log-compressor', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, path: str):
+        self.queue.put(path)
+
+    def _worker(self):
+        while True:
+            path = self.queue.get()
+            try:
+                if path is None:
+                    return
+                compress_with_index(path, self.method)
+            except Exception as e:
+                # Логировать через logging нельзя - можно попасть в сам обработчик
+                print(f"Log compression error: {path}: {e}", file=sys.stderr)
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout: float = 30.0):
+        """Дожидается сжатия уже ротированных файлов."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+def _rotation_order(path: str):
+    """Ключ сортировки ротированных файлов в хронологическом порядке.
+
+    bot.log.2024-01-01 < bot.log.2024-01-01.1 < ... < bot.log (текущий файл).
+    """
+    match = re.search(r'\.(\d{4}-\d{2}-\d{2})(?:\.(\d+))?(?:\.|$)', os.path.basename(path))
+    if not match:
+        return ('9999-99-99', 0)
+    return (match.group(1), int(match.group(2) or 0))
+
+
+def search_archive(index_path: str, chat_id: str):
+    """Возвращает строки лога пользователя из одного сжатого файла по индексу."""
+    with open(index_path, encoding='utf-8') as f:
+        index = json.load(f)
+
+    block_numbers = index['users'].get(chat_id)
+    if not block_numbers:
+        return []
+
+    pattern = re.compile(rb'User ' + re.escape(chat_id.encode()) + rb'\b')
+    archive_path = os.path.join(os.path.dirname(index_path), index['archive'])
+    lines = []
+    with open(archive_path, 'rb') as f:
+        for block_number in block_numbers:
+            offset, length = index['blocks'][block_number]
+            f.seek(offset)
+            data = _decompress_block(f.read(length), index['method'])
+            lines.extend(line for line in data.splitlines() if pattern.search(line))
+    return lines
+
+
+def search_logs(chat_id: str, log_dir: str = 'logs', base_name: str = 'bot.log'):
+    """Ищет строки пользователя во всех архивах и в текущем файле лога."""
+    results = []
+    for index_path in sorted(glob.glob(os.path.join(log_dir, base_name + '.*' + INDEX_SUFFIX)), key=_rotation_order):
+        results.extend(search_archive(index_path, chat_id))
+
+    # Текущий файл и еще не сжатые ротированные файлы просматриваем целиком
+    pattern = re.compile(rb'User ' + re.escape(chat_id.encode()) + rb'\b')
+    plain_files = [path for path in glob.glob(os.path.join(log_dir, base_name + '*'))
+                   if not path.endswith(('.gz', '.zst', INDEX_SUFFIX, '.tmp'))]
+    for path in sorted(plain_files, key=_rotation_order):
+        with open(path, 'rb') as f:
+            results.extend(line.rstrip(b'\r\n') for line in f if pattern.search(line))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск истории пользователя в логах бота")
+    parser.add_argument('chat_id')
+    parser.add_argument('--dir', default='logs')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    lines = search_logs(args.chat_id, args.dir)
+    for line in lines:
+        print(line.decode('utf-8', errors='replace'))
+    print(f"\n{len(lines)} строк, {(time.perf_counter() - started) * 1000:.1f} мс", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
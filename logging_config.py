@@ -6,6 +6,8 @@ import re
 import os
 import atexit
 
+from log_archive import LogCompressor, EXTENSIONS, INDEX_SUFFIX
+
 
 class MaskingFilter(logging.Filter):
     """Фильтр для маскирования персональных данных в логах"""
@@ -77,6 +79,68 @@ class MaskingFilter(logging.Filter):
         return True
 
 
+class CompressingRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Ротация логов по времени и по размеру со сжатием в фоновом потоке.
+
+    Ротированный файл переименовывается и передается LogCompressor, который
+    сжимает его и строит индекс chat_id для log_archive.py. При ротации по
+    размеру в течение дня к имени добавляется номер: bot.log.2024-01-01.1
+    """
+
+    def __init__(self, filename, when='midnight', interval=1, backupCount=0,
+                 encoding=None, maxBytes=0, compression='gzip'):
+        super().__init__(filename, when=when, interval=interval,
+                         backupCount=backupCount, encoding=encoding)
+        self.maxBytes = maxBytes
+        self.compressor = LogCompressor(compression)
+        self._compress_leftovers()
+
+    def _compress_leftovers(self):
+        """Досжимает файлы, оставшиеся несжатыми после аварийной остановки."""
+        for path in self._rotated_files():
+            if not path.endswith(tuple(EXTENSIONS.values()) + (INDEX_SUFFIX, '.tmp')):
+                self.compressor.submit(path)
+
+    def _rotated_files(self):
+        directory, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + '.'
+        return [os.path.join(directory, name) for name in os.listdir(directory)
+                if name.startswith(prefix) and re.match(r'\d{4}-\d{2}-\d{2}', name[len(prefix):])]
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.maxBytes > 0 and self.stream is not None:
+            return self.stream.tell() >= self.maxBytes
+        return False
+
+    def rotation_filename(self, default_name):
+        """Подбирает свободное имя, чтобы не перезаписать файл, ротированный ранее в тот же день."""
+        name = default_name
+        number = 0
+        while os.path.exists(name) or any(os.path.exists(name + ext) for ext in EXTENSIONS.values()):
+            number += 1
+            name = f"{default_name}.{number}"
+        return name
+
+    def rotate(self, source, dest):
+        if os.path.exists(source):
+            os.rename(source, dest)
+            self.compressor.submit(dest)
+
+    def getFilesToDelete(self):
+        """Возвращает файлы (архивы и индексы) за дни сверх backupCount."""
+        prefix_length = len(os.path.basename(self.baseFilename)) + 1
+        by_day = {}
+        for path in self._rotated_files():
+            by_day.setdefault(os.path.basename(path)[prefix_length:prefix_length + 10], []).append(path)
+
+        days = sorted(by_day)
+        if len(days) <= self.backupCount:
+            return []
+        return [path for day in days[:len(days) - self.backupCount] for path in by_day[day]]
+
+
 def setup_logging():
     """Настройка системы логирования"""
 
@@ -100,13 +164,15 @@ def setup_logging():
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    # 1. Обработчик для файлов (с ротацией по дням)
-    file_handler = logging.handlers.TimedRotatingFileHandler(
+    # 1. Обработчик для файлов (ротация по дням и по размеру, со сжатием)
+    file_handler = CompressingRotatingFileHandler(
         filename=os.path.join(log_dir, 'bot.log'),
         when='midnight',  # Ротация в полночь
         interval=1,  # Каждый день
         backupCount=30,  # Хранить 30 дней
-        encoding='utf-8'
+        encoding='utf-8',
+        maxBytes=50 * 1024 * 1024,  # И при превышении 50 МБ
+        compression=os.getenv('LOG_COMPRESSION', 'gzip')
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
@@ -0,0 +1,180 @@
+# message_templates.py
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
+from string import Formatter
+
+from logging_config import log_bot_event, log_error
+
+MESSAGES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messages.json')
+
+# Готовое к отправке сообщение: текст и вложения (клавиатура)
+StaticMessage = namedtuple('StaticMessage', ['text', 'attachments'])
+
+
+def compile_template(text: str):
+    """Разбирает шаблон один раз: строка без подстановок или кортеж (литерал, поле, ...)."""
+    parts = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(text):
+        if format_spec or conversion:
+            raise ValueError(f"Спецификаторы формата не поддерживаются: {text!r}")
+        if literal:
+            parts.append(literal)
+        if field_name is not None:
+            if not field_name:
+                raise ValueError(f"Пустое имя подстановки: {text!r}")
+            parts.append((field_name,))
+    if all(isinstance(part, str) for part in parts):
+        return ''.join(parts)
+    return tuple(parts)
+
+
+def template_fields(template) -> frozenset:
+    """Имена подстановок скомпилированного шаблона."""
+    if isinstance(template, str):
+        return frozenset()
+    return frozenset(part[0] for part in template if not isinstance(part, str))
+
+
+def check_compatible(templates: dict, default_locale: str, current: dict = None):
+    """Проверяет, что новые шаблоны можно подставить вместо текущих.
+
+    Бот обращается к текстам по ключам с фиксированным набором параметров,
+    поэтому в языке по умолчанию должны остаться все ключи текущей версии с
+    теми же подстановками, а в остальных языках - только известные ключи с
+    подстановками, как в языке по умолчанию.
+    """
+    default = templates[default_locale]
+    if current:
+        missing = current.keys() - default.keys()
+        if missing:
+            raise ValueError(f"Удалены тексты: {', '.join(sorted(missing))}")
+        for key, template in current.items():
+            if template_fields(default[key]) != template_fields(template):
+                raise ValueError(f"Изменены подстановки в {key}: ожидаются "
+                                 f"{sorted(template_fields(template))}, в файле {sorted(template_fields(default[key]))}")
+
+    for locale, messages in templates.items():
+        for key, template in messages.items():
+            if key not in default:
+                raise ValueError(f"Текст {locale}.{key} отсутствует в языке по умолчанию")
+            if template_fields(template) != template_fields(default[key]):
+                raise ValueError(f"Подстановки в {locale}.{key} не совпадают с языком по умолчанию")
+
+
+class MessageTemplates:
+    """Тексты сообщений бота, загружаемые из messages.json.
+
+    Шаблоны компилируются при загрузке; статические тексты хранятся готовыми
+    строками, результаты подстановки кешируются по аргументам. Файл
+    перечитывается при изменении (проверка mtime не чаще раза в check_interval
+    секунд), после чего вызываются подписчики on_reload - например, для
+    пересборки готовых клавиатур. Новая версия принимается, только если в
+    ней есть все прежние тексты с теми же подстановками и подписчики
+    отработали без ошибок; иначе остаются прежние тексты.
+    """
+
+    def __init__(self, path: str = MESSAGES_FILE, check_interval: float = 1.0, cache_size: int = 10000):
+        self.path = path
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self.default_locale = 'ru'
+        self.templates = {}
+        self.cache = OrderedDict()
+        self.mtime = None
+        self.checked_at = 0.0
+        self.reload_callbacks = []
+        self._load()
+
+    def _load(self) -> bool:
+        """Загружает и компилирует шаблоны. При ошибке остаются прежние."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            templates = {
+                locale: {key: compile_template(text) for key, text in messages.items()}
+                for locale, messages in data['locales'].items()
+            }
+            default_locale = data.get('default_locale', self.default_locale)
+            if default_locale not in templates:
+                raise ValueError(f"Нет текстов для языка по умолчанию: {default_locale}")
+            check_compatible(templates, default_locale, self.templates.get(self.default_locale))
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            log_error("Failed to load message templates", f"File: {self.path}, Error: {str(e)}")
+            if not self.templates:
+                raise
+            return False
+
+        self.templates = templates
+        self.default_locale = default_locale
+        self.mtime = mtime
+        self.cache.clear()
+        log_bot_event("Message templates loaded", f"Locales: {', '.join(templates)}")
+        return True
+
+    def on_reload(self, callback):
+        """Регистрирует функцию, вызываемую после каждой загрузки шаблонов."""
+        self.reload_callbacks.append(callback)
+        callback()
+        return callback
+
+    def check_reload(self):
+        """Перечитывает файл, если он изменился."""
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+
+        previous = (self.templates, self.default_locale)
+        if not self._load():
+            # Ошибка уже записана; файл не перечитывается до следующего изменения
+            self.mtime = mtime
+            return
+        try:
+            self._run_callbacks()
+        except Exception as e:
+            log_error("Message templates reload rejected", f"File: {self.path}, Error: {str(e)}")
+            self.templates, self.default_locale = previous
+            self.cache.clear()
+            # Подписчики пересобирают данные по прежним текстам, с которыми они уже работали
+            self._run_callbacks()
+
+    def _run_callbacks(self):
+        for callback in self.reload_callbacks:
+            callback()
+
+    def render(self, key: str, locale: str = None, **params) -> str:
+        """Возвращает текст сообщения с подстановкой параметров."""
+        self.check_reload()
+
+        messages = self.templates.get(locale) or self.templates[self.default_locale]
+        template = messages.get(key)
+        if template is None:
+            template = self.templates[self.default_locale][key]
+        if isinstance(template, str):
+            return template
+
+        cache_key = (key, locale, tuple(params.items()))
+        text = self.cache.get(cache_key)
+        if text is not None:
+            self.cache.move_to_end(cache_key)
+            return text
+
+        text = ''.join(part if isinstance(part, str) else str(params[part[0]]) for part in template)
+        self.cache[cache_key] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
+
+
+# Экземпляр шаблонов, который импортируется в боте
+templates = MessageTemplates()
@@ -0,0 +1,42 @@
+# multi_bot.py
+import asyncio
+import os
+
+from maxapi import Bot, Dispatcher
+
+import bot_1_win11
+from logging_config import log_bot_event, log_error
+from tenants import Tenant, register_tenant, load_bots_config
+
+
+def build_tenants(configs: list) -> list:
+    """Создает ботов по конфигурации; обработчики у всех общие."""
+    tenants = []
+    for config in configs:
+        dispatcher = Dispatcher()
+        bot_1_win11.register_handlers(dispatcher)
+        tenant = Tenant(
+            config['name'],
+            Bot(os.getenv(config['token_env'])),
+            dispatcher,
+            config['webhook_url'],
+            config['webhook_path'],
+            greeted_ttl_days=config.get('greeted_ttl_days', 90)
+        )
+        tenants.append(register_tenant(tenant))
+    return tenants
+
+
+async def main():
+    build_tenants(load_bots_config())
+    await bot_1_win11.run_tenants()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        log_bot_event("Bot stopped manually")
+    except Exception as e:
+        log_error("Bot crashed", f"Error: {str(e)}")
+        raise
@@ -0,0 +1,119 @@
+# pii_crypto.py
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Конфигурация шифрования персональных данных ---
+# PII_MASTER_KEY - 32 байта в base64; без него данные хранятся открыто
+PII_MASTER_KEY = os.getenv("PII_MASTER_KEY")
+# Номер текущего ключа шифрования; старые ключи остаются доступны для расшифровки
+PII_KEY_ID = int(os.getenv("PII_KEY_ID", "1"))
+
+_NONCE_SIZE = 12
+
+
+class PiiCipher:
+    """Шифрование полей с персональными данными (AES-256-GCM).
+
+    Ключи шифрования выводятся из мастер-ключа через HKDF по номеру ключа и
+    кешируются в процессе. Номер ключа хранится в первом байте шифротекста,
+    поэтому смена PII_KEY_ID не мешает читать старые записи. Для поиска без
+    расшифровки используется детерминированный HMAC-SHA256 (lookup_hash).
+    """
+
+    def __init__(self, master_key: bytes, key_id: int = 1):
+        if len(master_key) != 32:
+            raise ValueError("PII_MASTER_KEY должен содержать 32 байта")
+        if not 0 < key_id < 256:
+            raise ValueError("PII_KEY_ID должен быть в диапазоне 1-255")
+        self.master_key = master_key
+        self.key_id = key_id
+        self._keys = {}
+        self._lookup_key = self._derive(b'pii-lookup')
+
+    def _derive(self, info: bytes) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(self.master_key)
+
+    def _key(self, key_id: int) -> AESGCM:
+        """Возвращает ключ шифрования по номеру (из кеша)."""
+        key = self._keys.get(key_id)
+        if key is None:
+            key = AESGCM(self._derive(b'pii-encryption-%d' % key_id))
+            self._keys[key_id] = key
+        return key
+
+    def encrypt(self, value: str, field: str) -> bytes:
+        """Шифрует значение поля; имя поля связывается с шифротекстом."""
+        nonce = os.urandom(_NONCE_SIZE)
+        ciphertext = self._key(self.key_id).encrypt(nonce, value.encode('utf-8'), field.encode())
+        return bytes((self.key_id,)) + nonce + ciphertext
+
+    def decrypt(self, blob: bytes, field: str) -> str:
+        """Расшифровывает значение поля."""
+        blob = bytes(blob)
+        nonce = blob[1:1 + _NONCE_SIZE]
+        try:
+            plaintext = self._key(blob[0]).decrypt(nonce, blob[1 + _NONCE_SIZE:], field.encode())
+        except InvalidTag:
+            raise ValueError(f"Не удалось расшифровать поле {field}: неверный ключ или поврежденные данные")
+        return plaintext.decode('utf-8')
+
+    def seal(self, value: str, field: str) -> str:
+        """Шифрует значение поля в текст base64 - для JSON-файлов состояния."""
+        return base64.b64encode(self.encrypt(value, field)).decode('ascii')
+
+    def unseal(self, token: str, field: str) -> str:
+        """Расшифровывает значение, зашифрованное seal()."""
+        return self.decrypt(base64.b64decode(token), field)
+
+    def lookup_hash(self, value: str) -> bytes:
+        """Детерминированный ключевой хеш для поиска и проверки уникальности."""
+        return hmac.new(self._lookup_key, value.encode('utf-8'), hashlib.sha256).digest()
+
+
+def load_cipher():
+    """Создает PiiCipher по настройкам окружения или возвращает None, если ключ не задан."""
+    if not PII_MASTER_KEY:
+        return None
+    return PiiCipher(base64.b64decode(PII_MASTER_KEY), PII_KEY_ID)
+
+
+def generate_master_key() -> str:
+    """Генерирует новый мастер-ключ в формате для PII_MASTER_KEY."""
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Шифрование персональных данных пользователей")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('genkey', help="Сгенерировать мастер-ключ")
+    subparsers.add_parser('encrypt-existing', help="Зашифровать записи, сохраненные открыто")
+    args = parser.parse_args()
+
+    if args.command == 'genkey':
+        print(f"PII_MASTER_KEY={generate_master_key()}")
+        return 0
+
+    from user_database import db
+
+    if not db.cipher:
+        print("PII_MASTER_KEY не задан")
+        return 1
+    db.set_query_timeout(None)
+    print(f"Зашифровано записей: {db.encrypt_existing_users()}")
+    db.close_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,210 @@
+# replay_updates.py
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+os.environ.setdefault("MAXAPI_TOKEN", "replay")
+
+from maxapi import Bot
+from maxapi.enums.chat_status import ChatStatus
+from maxapi.enums.chat_type import ChatType
+from maxapi.methods.types.getted_updates import process_update_webhook
+from maxapi.types.chats import Chat
+
+from scratch_schema import drop_scratch_schema, use_scratch_schema
+from update_recorder import read_updates
+
+load_dotenv()
+
+# Воспроизведение пишет регистрации в отдельную схему, а не в рабочую таблицу users.
+# user_database здесь не импортируется до настройки схемы: при импорте он сразу подключается к базе
+REPLAY_SCHEMA = 'replay_updates'
+
+# Методы базы данных, время которых учитывается отдельно
+TIMED_DB_METHODS = ('is_user_registered', 'get_user_greeting', 'register_user')
+
+# Время базы данных в обновлении, которое сейчас воспроизводится: [секунды]
+_update_db_time = contextvars.ContextVar('update_db_time', default=None)
+
+
+class StubBot(Bot):
+    """Заглушка Bot: не обращается к API MAX, только считает исходящие сообщения.
+
+    auto_requests остается включенным: только тогда maxapi проставляет
+    event.bot, по которому обработчики находят своего бота. Запрос данных
+    чата, который при этом делает maxapi, обслуживается на месте.
+    """
+
+    def __init__(self, send_latency: float = 0.0):
+        super().__init__("replay-stub-token")
+        self.send_latency = send_latency
+        self.sent = 0
+
+    async def get_chat_by_id(self, id: int):
+        return Chat(chat_id=id, type=ChatType.DIALOG, status=ChatStatus.ACTIVE,
+                    last_event_time=int(time.time() * 1000), participants_count=2, is_public=False)
+
+    async def send_message(self, *args, **kwargs):
+        self.sent += 1
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        return None
+
+
+class ErrorCounter(logging.Handler):
+    """Считает ошибки обработчиков: Dispatcher.handle перехватывает их и только пишет в журнал."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+
+class Timings:
+    """Накопитель длительностей по именам операций."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, name: str, seconds: float):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def report(self, title: str):
+        print(f"\n{title}")
+        print(f"{'':<24}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            count = len(values)
+            print(f"{name:<24}{count:>8}"
+                  f"{sum(values) / count * 1000:>10.2f}"
+                  f"{values[count // 2] * 1000:>10.2f}"
+                  f"{values[min(count - 1, int(count * 0.95))] * 1000:>10.2f}"
+                  f"{values[-1] * 1000:>10.2f}")
+
+
+def time_database_methods(database, timings: Timings):
+    """Оборачивает методы базы данных замером времени.
+
+    Время учитывается по методу и добавляется к счетчику текущего
+    обновления (_update_db_time), чтобы отчет показал его и по типу обновления.
+    """
+    for name in TIMED_DB_METHODS:
+        method = getattr(database, name)
+
+        @functools.wraps(method)
+        def timed(*args, _method=method, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                timings.add(_name, elapsed)
+                update_db_time = _update_db_time.get()
+                if update_db_time is not None:
+                    update_db_time[0] += elapsed
+
+        setattr(database, name, timed)
+
+
+async def replay(path: str, speed: float, send_latency: float) -> int:
+    """Прогоняет записанные обновления через обработчики бота."""
+    use_scratch_schema(REPLAY_SCHEMA)
+
+    import bot_1_win11
+    from funnel_events import FunnelEventLog
+    from tenants import Tenant, register_tenant
+
+    from webhook_server import prepare_dispatcher
+
+    stub_bot = StubBot(send_latency)
+    dispatcher = bot_1_win11.dp
+    await prepare_dispatcher(stub_bot, dispatcher, check_me=False)
+    # Состояние воспроизведения хранится отдельно, как у любого другого бота
+    register_tenant(Tenant('replay', stub_bot, dispatcher, webhook_url=''))
+
+    # События воронки при воспроизведении не должны попасть в рабочий файл
+    bot_1_win11.funnel_log = FunnelEventLog(os.path.join(tempfile.mkdtemp(), 'funnel_events.bin'))
+
+    handler_timings = Timings()
+    db_timings = Timings()
+    db_type_timings = Timings()
+    time_database_methods(bot_1_win11.db, db_timings)
+    handler_errors = ErrorCounter()
+    logging.getLogger('dispatcher').addHandler(handler_errors)
+
+    replayed = failed = 0
+    first_timestamp = None
+    started = time.perf_counter()
+    try:
+        for timestamp, body in read_updates(path):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if speed > 0:
+                # Сохраняем исходные интервалы между обновлениями (с ускорением)
+                delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            event_json = json.loads(body)
+            update_type = event_json.get('update_type', 'unknown')
+            update_db_time = [0.0]
+            context_token = _update_db_time.set(update_db_time)
+            update_started = time.perf_counter()
+            try:
+                event_object = await process_update_webhook(event_json=event_json, bot=stub_bot)
+                await dispatcher.handle(event_object)
+            except Exception as e:
+                failed += 1
+                print(f"Update failed ({update_type}): {e}")
+            finally:
+                _update_db_time.reset(context_token)
+            handler_timings.add(update_type, time.perf_counter() - update_started)
+            db_type_timings.add(update_type, update_db_time[0])
+            replayed += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        logging.getLogger('dispatcher').removeHandler(handler_errors)
+        bot_1_win11.db.close_connection()
+        drop_scratch_schema(REPLAY_SCHEMA)
+
+    print(f"Replayed {replayed} updates in {elapsed:.2f}s "
+          f"({replayed / elapsed if elapsed else 0:.0f} updates/s), "
+          f"not parsed: {failed}, handler errors: {handler_errors.errors}, messages sent: {stub_bot.sent}")
+    handler_timings.report("Handlers by update type")
+    db_timings.report("Database calls")
+    db_type_timings.report("Database time per update by update type")
+    return 1 if failed or handler_errors.errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика вебхука")
+    parser.add_argument('file', help="Файл, записанный с RECORD_UPDATES_FILE")
+    parser.add_argument('--speed', default='max',
+                        help="original - исходная скорость, число - ускорение, max - без пауз "
+                             "(при ускорении бот отбрасывает нажатия одного чата чаще раза в секунду)")
+    parser.add_argument('--send-latency', type=float, default=0.0,
+                        help="Имитация задержки API MAX при отправке сообщения, сек")
+    args = parser.parse_args()
+
+    if args.speed == 'max':
+        speed = 0.0
+    elif args.speed == 'original':
+        speed = 1.0
+    else:
+        speed = float(args.speed)
+
+    return asyncio.run(replay(args.file, speed, args.send_latency))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,46 @@
+# scratch_schema.py
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Настройки настоящей базы читаются при импорте: chaos_check потом направляет
+# бота в прокси через DB_HOST/DB_PORT, а служебные запросы идут в базу напрямую.
+# user_database здесь не импортируется: при импорте он сразу подключается к базе
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+
+def admin_execute(query: str, params=None):
+    """Выполняет служебный запрос в отдельном соединении; возвращает первую строку результата."""
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone() if cursor.description else None
+    finally:
+        conn.close()
+
+
+def use_scratch_schema(schema: str):
+    """Пересоздает схему и направляет в нее все новые соединения процесса.
+
+    search_path задается через PGOPTIONS и остается до drop_scratch_schema():
+    переподключение UserDatabase после обрыва тоже попадает в эту схему, а
+    не в рабочую таблицу users.
+    """
+    admin_execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};")
+    os.environ['PGOPTIONS'] = f"-c search_path={schema}"
+
+
+def drop_scratch_schema(schema: str, keep: bool = False):
+    """Возвращает соединения в схему по умолчанию и удаляет схему (keep - оставить для разбора)."""
+    os.environ.pop('PGOPTIONS', None)
+    if not keep:
+        admin_execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
@@ -0,0 +1,88 @@
+# sessions.py
+from enum import IntEnum
+
+
+class SessionState(IntEnum):
+    """Шаг регистрации. Коды совпадают с funnel_events.STATE_CODES."""
+    WAITING_FIO = 3
+    WAITING_BIRTH_DATE = 4
+    WAITING_PHONE = 5
+    WAITING_CONFIRMATION = 6
+
+
+class RegistrationSession:
+    """Незавершенная регистрация одного чата.
+
+    Поля хранятся в компактном виде: ФИО - UTF-8 байтами, дата рождения -
+    числом ГГГГММДД, телефон - десятью цифрами после +7 одним числом.
+    Незаполненное поле - None (0 - допустимое значение, например +70000000000).
+    Переходы меняют запись на месте, новые объекты при вводе не создаются.
+    Строковые значения для сообщений и базы данных собираются по запросу.
+    """
+
+    __slots__ = ('state', '_fio', '_birth_date', '_phone')
+
+    def __init__(self, state: SessionState = SessionState.WAITING_FIO):
+        self.state = state
+        self._fio = None
+        self._birth_date = None
+        self._phone = None
+
+    @property
+    def fio(self):
+        return self._fio.decode('utf-8') if self._fio is not None else None
+
+    @fio.setter
+    def fio(self, value):
+        self._fio = value.encode('utf-8') if value is not None else None
+
+    @property
+    def birth_date(self):
+        """Дата рождения в формате ДД.ММ.ГГГГ (уже проверенном validate_birth_date)."""
+        if self._birth_date is None:
+            return None
+        year, month_day = divmod(self._birth_date, 10000)
+        month, day = divmod(month_day, 100)
+        return f"{day:02d}.{month:02d}.{year:04d}"
+
+    @birth_date.setter
+    def birth_date(self, value):
+        if value is None:
+            self._birth_date = None
+            return
+        day, month, year = map(int, value.split('.'))
+        self._birth_date = year * 10000 + month * 100 + day
+
+    @property
+    def phone(self):
+        """Телефон в формате +7XXXXXXXXXX (уже проверенном validate_phone)."""
+        return f"+7{self._phone:010d}" if self._phone is not None else None
+
+    @phone.setter
+    def phone(self, value):
+        self._phone = int(value[2:]) if value is not None else None
+
+    @property
+    def is_complete(self) -> bool:
+        return self._fio is not None and self._birth_date is not None and self._phone is not None
+
+    def next_state(self) -> SessionState:
+        """Следующий шаг после ввода поля: первое недостающее поле или подтверждение."""
+        if self._birth_date is None:
+            return SessionState.WAITING_BIRTH_DATE
+        if self._phone is None:
+            return SessionState.WAITING_PHONE
+        return SessionState.WAITING_CONFIRMATION
+
+    def to_list(self) -> list:
+        """Компактное представление для снимка состояния."""
+        return [int(self.state), self.fio, self._birth_date, self._phone]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'RegistrationSession':
+        state, fio, birth_date, phone = values
+        session = cls(SessionState(state))
+        session.fio = fio
+        session._birth_date = birth_date
+        session._phone = phone
+        return session
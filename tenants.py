@@ -0,0 +1,128 @@
+# tenants.py
+import json
+import os
+
+from greeted_store import GreetedChats, GREETED_FILE
+from logging_config import log_warning
+from sessions import RegistrationSession, SessionState
+
+BOTS_CONFIG_FILE = os.getenv("BOTS_CONFIG", "bots.json")
+
+
+class Tenant:
+    """Бот одной медицинской организации и его изолированное состояние.
+
+    Все боты процесса используют общие сервер вебхука, подключение к БД и
+    фоновые задачи, но состояния регистрации, защита от дублей и список
+    поприветствованных чатов у каждого свои. Имя бота записывается в
+    колонку users.tenant: телефон уникален в пределах организации.
+    """
+
+    def __init__(self, name: str, bot, dispatcher, webhook_url: str, webhook_path: str = '/',
+                 greeted_ttl_days: int = 90):
+        self.name = name
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.webhook_url = webhook_url
+        self.webhook_path = webhook_path
+
+        # Словари для хранения состояний и защиты от дублирования
+        # Незавершенные регистрации: chat_id (int) -> RegistrationSession
+        self.user_states = {}
+        self.greeted_users = GreetedChats(ttl_days=greeted_ttl_days)
+        self.processed_messages = set()
+        self.processed_callbacks = set()
+        # Обработанные запуски бота: (chat_id, timestamp обновления)
+        self.processed_starts = set()
+        self.last_processed = {}
+
+    @property
+    def greeted_file(self) -> str:
+        if self.name == 'default':
+            return GREETED_FILE
+        root, ext = os.path.splitext(GREETED_FILE)
+        return f"{root}.{self.name}{ext}"
+
+    def snapshot(self, cipher=None) -> dict:
+        """Собирает состояние в памяти для сохранения при остановке.
+
+        ФИО, дата рождения и телефон незавершенных регистраций - персональные
+        данные пациентов: с cipher они сохраняются зашифрованными, без него
+        в снимок не попадают, и регистрация продолжится с ввода ФИО.
+        """
+        if cipher:
+            user_states = {
+                chat_id: [int(session.state), cipher.seal(json.dumps(session.to_list()[1:]), 'session')]
+                for chat_id, session in self.user_states.items()
+            }
+        else:
+            user_states = {chat_id: [int(SessionState.WAITING_FIO)] for chat_id in self.user_states}
+        return {
+            'user_states': user_states,
+            'processed_messages': list(self.processed_messages),
+            'processed_callbacks': list(self.processed_callbacks),
+            'processed_starts': [list(start_id) for start_id in self.processed_starts],
+        }
+
+    def restore(self, state: dict, cipher=None):
+        """Восстанавливает состояние из снимка, сохраненного при остановке."""
+        for chat_id, values in state.get('user_states', {}).items():
+            session = RegistrationSession(SessionState(values[0]))
+            if len(values) > 1:
+                try:
+                    if not cipher:
+                        raise ValueError("PII_MASTER_KEY не задан")
+                    fields = json.loads(cipher.unseal(values[1], 'session'))
+                    session = RegistrationSession.from_list([values[0]] + fields)
+                except ValueError as e:
+                    # Без данных регистрация начинается заново с ввода ФИО
+                    log_warning("Registration state not restored", f"User {chat_id}, Error: {str(e)}")
+                    session = RegistrationSession()
+            # Ключи JSON - строки, в памяти chat_id хранится числом
+            self.user_states[int(chat_id)] = session
+        self.processed_messages.update(state.get('processed_messages', []))
+        self.processed_callbacks.update(state.get('processed_callbacks', []))
+        self.processed_starts.update(tuple(start_id) for start_id in state.get('processed_starts', []))
+
+
+# Зарегистрированные боты: id(Bot) -> Tenant
+_tenants = {}
+
+
+def register_tenant(tenant: Tenant) -> Tenant:
+    """Регистрирует бота в процессе."""
+    _tenants[id(tenant.bot)] = tenant
+    return tenant
+
+
+def tenant_for(bot) -> Tenant:
+    """Возвращает Tenant бота, которому пришло обновление."""
+    return _tenants[id(bot)]
+
+
+def all_tenants() -> list:
+    return list(_tenants.values())
+
+
+def load_bots_config(path: str = BOTS_CONFIG_FILE) -> list:
+    """Читает конфигурацию ботов.
+
+    Формат: [{"name": ..., "token_env": ..., "webhook_url": ..., "webhook_path": ...}];
+    токены берутся из переменных окружения, чтобы не хранить их в файле.
+    """
+    with open(path, encoding='utf-8') as f:
+        configs = json.load(f)
+
+    names = set()
+    paths = set()
+    for config in configs:
+        for key in ('name', 'token_env', 'webhook_url', 'webhook_path'):
+            if not config.get(key):
+                raise ValueError(f"{path}: у бота не задан параметр {key}")
+        if config['name'] in names or config['webhook_path'] in paths:
+            raise ValueError(f"{path}: повторяется имя или путь вебхука бота {config['name']}")
+        if not os.getenv(config['token_env']):
+            raise ValueError(f"{path}: переменная окружения {config['token_env']} не задана")
+        names.add(config['name'])
+        paths.add(config['webhook_path'])
+    return configs
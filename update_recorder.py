@@ -0,0 +1,116 @@
+# update_recorder.py
+import asyncio
+import atexit
+import os
+import struct
+import time
+import zlib
+
+from logging_config import log_bot_event, log_error, log_warning
+
+RECORD_UPDATES_FILE = os.getenv("RECORD_UPDATES_FILE")
+
+# Заголовок записи: время получения (double) и длина тела (uint32)
+RECORD_HEADER = struct.Struct('<dI')
+
+# Заголовок кадра (одного сброса буфера): метка, длина и CRC32 сжатых данных
+FRAME_HEADER = struct.Struct('<4sII')
+FRAME_MAGIC = b'MXU1'
+
+
+class UpdateRecorder:
+    """Запись сырых обновлений вебхука в сжатый файл для последующего воспроизведения.
+
+    Записи (время, длина, тело) копятся в памяти и при каждом сбросе
+    дописываются в файл отдельным сжатым кадром со своей длиной и CRC32.
+    Кадр, оборванный при падении процесса, отрезается при следующем
+    открытии файла, поэтому новые записи идут сразу после целых, а теряется
+    только последний несброшенный пакет.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_buffer: int = 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer = bytearray()
+        self.recorded = 0
+        self._repair()
+        atexit.register(self.flush)
+
+    def _repair(self):
+        """Отрезает оборванный хвост файла, оставшийся после падения во время сброса."""
+        try:
+            size = os.path.getsize(self.path)
+            with open(self.path, 'rb') as f:
+                good = 0
+                for good, _ in _read_frames(f):
+                    pass
+            if good < size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(good)
+                log_warning("Truncated torn recording tail", f"File: {self.path}, Bytes: {size - good}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log_error("Failed to check recorded updates", f"File: {self.path}, Error: {str(e)}")
+
+    def record(self, body: bytes, timestamp: float = None):
+        """Добавляет тело обновления в буфер."""
+        self.buffer += RECORD_HEADER.pack(timestamp or time.time(), len(body))
+        self.buffer += body
+        self.recorded += 1
+        if len(self.buffer) >= self.max_buffer:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Дописывает буфер в файл новым кадром."""
+        if not self.buffer:
+            return True
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            payload = zlib.compress(bytes(self.buffer), 6)
+            with open(self.path, 'ab') as f:
+                f.write(FRAME_HEADER.pack(FRAME_MAGIC, len(payload), zlib.crc32(payload)) + payload)
+            self.buffer.clear()
+            return True
+        except OSError as e:
+            log_error("Failed to write recorded updates", f"File: {self.path}, Error: {str(e)}")
+            return False
+
+    async def run_flusher(self):
+        """Периодически сбрасывает буфер на диск."""
+        log_bot_event("Recording webhook updates", f"File: {self.path}")
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+
+def _read_frames(f):
+    """Целые кадры файла: (смещение конца кадра, сжатые данные). Останавливается на первом поврежденном."""
+    while True:
+        header = f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        magic, length, crc = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            return
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield f.tell(), payload
+
+
+def read_updates(path: str):
+    """Читает записанные обновления: (время, тело). Оборванный хвост файла пропускается."""
+    with open(path, 'rb') as f:
+        for _, payload in _read_frames(f):
+            data = zlib.decompress(payload)
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+                offset += RECORD_HEADER.size
+                yield timestamp, data[offset:offset + length]
+                offset += length
@@ -0,0 +1,418 @@
+# user_admin.py
+import argparse
+import base64
+import csv
+import json
+import logging
+import sys
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from user_database import USERS_CHANGED_CHANNEL
+
+PAGE_SIZE = 50
+BATCH_SIZE = 1000
+# chat_id в одном уведомлении: полезная нагрузка NOTIFY ограничена 8000 байт
+NOTIFY_CHUNK = 200
+
+UPDATABLE_FIELDS = ('fio', 'phone', 'birth_date')
+
+# Индексы для поиска по префиксу. Сравнение в collation "C" позволяет
+# использовать btree для LIKE 'префикс%' при любой локали базы
+ADMIN_INDEXES = {
+    'users_phone_chat_prefix_idx': 'ON users ((phone COLLATE "C"), chat_id)',
+    'users_fio_prefix_idx': 'ON users ((lower(fio) COLLATE "C"), chat_id)',
+}
+# Индексы прежних версий, замененные ADMIN_INDEXES
+OBSOLETE_ADMIN_INDEXES = ('users_phone_prefix_idx',)
+
+_USER_COLUMNS = "chat_id, tenant, fio, phone, birth_date, registration_date"
+_ENCRYPTED_COLUMNS = "fio_enc, phone_enc, birth_date_enc"
+
+
+def _like_prefix(prefix: str) -> str:
+    """Шаблон LIKE для префикса с экранированием спецсимволов."""
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def encode_cursor(key) -> str:
+    """Курсор следующей страницы в виде, удобном для командной строки."""
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode()).decode()
+
+
+def decode_cursor(token: str):
+    return json.loads(base64.urlsafe_b64decode(token.encode()))
+
+
+class UserAdmin:
+    """Просмотр, исправление и удаление пользователей для поддержки.
+
+    Списки постраничные по ключу (keyset): следующая страница начинается после
+    последней строки предыдущей, поэтому стоимость запроса не зависит от
+    номера страницы. Массовые изменения идут пакетами, каждый пакет - своя
+    транзакция вместе с уведомлением USERS_CHANGED_CHANNEL, по которому бот
+    сбрасывает данные этих пользователей в памяти.
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+    def create_indexes(self):
+        """Создает индексы для поиска, не блокируя запись в таблицу."""
+        conn = self.database.connection()
+        if not conn:
+            return
+
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        conn.rollback()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for name, definition in ADMIN_INDEXES.items():
+                    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition};")
+                    logging.info(f"INFO: Индекс {name} проверен/создан.")
+                for name in OBSOLETE_ADMIN_INDEXES:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to create admin indexes, Error: {str(e)}")
+            self.database.recover(e)
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+
+    # --- Чтение ---
+
+    def _select(self, where: str, order: str, params: tuple, limit: int) -> list:
+        encrypted = _ENCRYPTED_COLUMNS if self.database.cipher else "NULL, NULL, NULL"
+        conn = self.database.connection()
+        if not conn:
+            raise psycopg2.OperationalError("База данных недоступна")
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {_USER_COLUMNS}, {encrypted} FROM users WHERE {where} ORDER BY {order} LIMIT %s",
+                    params + (limit,)
+                )
+                rows = cursor.fetchall()
+            conn.rollback()
+        except psycopg2.Error as e:
+            self.database.recover(e)
+            raise
+        return [self._decrypt_row(row) for row in rows]
+
+    def _decrypt_row(self, row) -> dict:
+        chat_id, tenant, fio, phone, birth_date, registration_date, fio_enc, phone_enc, birth_date_enc = row
+        user = {'chat_id': chat_id, 'tenant': tenant, 'registration_date': registration_date}
+        for field, plain, encrypted in (('fio', fio, fio_enc), ('phone', phone, phone_enc),
+                                        ('birth_date', birth_date, birth_date_enc)):
+            try:
+                user[field] = self.database.read_field(plain, encrypted, field)
+            except ValueError:
+                user[field] = None
+        return user
+
+    def list_users(self, after: str = '', limit: int = PAGE_SIZE):
+        """Страница пользователей по возрастанию chat_id. Возвращает (строки, курсор или None)."""
+        users = self._select("chat_id > %s", "chat_id", (after,), limit)
+        next_after = users[-1]['chat_id'] if len(users) == limit else None
+        return users, next_after
+
+    def iter_users(self, batch_size: int = BATCH_SIZE):
+        """Все пользователи потоком, страницами по batch_size - память не зависит от размера таблицы."""
+        after = ''
+        while after is not None:
+            users, after = self.list_users(after, batch_size)
+            yield from users
+
+    def search_by_phone(self, prefix: str, after=('', ''), limit: int = PAGE_SIZE):
+        """Пользователи с телефоном, начинающимся с prefix, по возрастанию телефона.
+
+        Курсор - пара (телефон, chat_id): один номер может быть у пользователей
+        разных организаций. При включенном шифровании по префиксу ищутся только
+        записи, еще не переведенные в шифрованный вид; зашифрованные находятся
+        по полному номеру.
+        """
+        if self.database.cipher and self.database.validate_phone(prefix) and not any(after):
+            users = self._select("phone_hash = %s OR phone = %s", "chat_id",
+                                 (self.database.phone_lookup_hash(prefix), prefix), limit)
+            return users, None
+
+        users = self._select(
+            'phone COLLATE "C" LIKE %s AND (phone COLLATE "C", chat_id) > (%s, %s)',
+            'phone COLLATE "C", chat_id',
+            (_like_prefix(prefix), after[0], after[1]), limit
+        )
+        next_after = [users[-1]['phone'], users[-1]['chat_id']] if len(users) == limit else None
+        return users, next_after
+
+    def search_by_fio(self, prefix: str, after=('', ''), limit: int = PAGE_SIZE):
+        """Пользователи с ФИО, начинающимся с prefix (без учета регистра).
+
+        Курсор - пара (ФИО в нижнем регистре, chat_id). Зашифрованные ФИО по
+        префиксу не ищутся.
+        """
+        users = self._select(
+            'lower(fio) COLLATE "C" LIKE %s AND (lower(fio) COLLATE "C", chat_id) > (%s, %s)',
+            'lower(fio) COLLATE "C", chat_id',
+            (_like_prefix(prefix.lower()), after[0], after[1]), limit
+        )
+        next_after = [users[-1]['fio'].lower(), users[-1]['chat_id']] if len(users) == limit else None
+        return users, next_after
+
+    # --- Массовые изменения ---
+
+    def _notify(self, cursor, action: str, chat_ids: list):
+        for start in range(0, len(chat_ids), NOTIFY_CHUNK):
+            payload = json.dumps({'action': action, 'chat_ids': chat_ids[start:start + NOTIFY_CHUNK]})
+            cursor.execute("SELECT pg_notify(%s, %s)", (USERS_CHANGED_CHANNEL, payload))
+
+    def _update_batch(self, cursor, rows: list) -> list:
+        """Обновляет пакет строк одним запросом. Пустое поле оставляет значение без изменений."""
+        if self.database.cipher:
+            cipher = self.database.cipher
+            values = [(
+                row['chat_id'],
+                cipher.encrypt(row['fio'], 'fio') if row.get('fio') else None,
+                cipher.encrypt(row['phone'], 'phone') if row.get('phone') else None,
+                cipher.encrypt(row['birth_date'], 'birth_date') if row.get('birth_date') else None,
+                self.database.phone_lookup_hash(row['phone']) if row.get('phone') else None,
+            ) for row in rows]
+            updated = execute_values(cursor, """
+                UPDATE users AS u SET
+                    fio_enc = COALESCE(v.fio_enc, u.fio_enc),
+                    fio = CASE WHEN v.fio_enc IS NULL THEN u.fio END,
+                    phone_enc = COALESCE(v.phone_enc, u.phone_enc),
+                    phone_hash = COALESCE(v.phone_hash, u.phone_hash),
+                    phone = CASE WHEN v.phone_enc IS NULL THEN u.phone END,
+                    birth_date_enc = COALESCE(v.birth_date_enc, u.birth_date_enc),
+                    birth_date = CASE WHEN v.birth_date_enc IS NULL THEN u.birth_date END
+                FROM (VALUES %s) AS v(chat_id, fio_enc, phone_enc, birth_date_enc, phone_hash)
+                WHERE u.chat_id = v.chat_id
+                RETURNING u.chat_id
+            """, values, template="(%s, %s::bytea, %s::bytea, %s::bytea, %s::bytea)", fetch=True)
+        else:
+            values = [(row['chat_id'], row.get('fio') or None, row.get('phone') or None,
+                       row.get('birth_date') or None) for row in rows]
+            updated = execute_values(cursor, """
+                UPDATE users AS u SET
+                    fio = COALESCE(v.fio, u.fio),
+                    phone = COALESCE(v.phone, u.phone),
+                    birth_date = COALESCE(v.birth_date, u.birth_date)
+                FROM (VALUES %s) AS v(chat_id, fio, phone, birth_date)
+                WHERE u.chat_id = v.chat_id
+                RETURNING u.chat_id
+            """, values, template="(%s, %s::text, %s::varchar, %s::varchar)", fetch=True)
+        return [chat_id for chat_id, in updated]
+
+    def _delete_batch(self, cursor, rows: list) -> list:
+        cursor.execute("DELETE FROM users WHERE chat_id = ANY(%s) RETURNING chat_id",
+                       ([row['chat_id'] for row in rows],))
+        return [chat_id for chat_id, in cursor.fetchall()]
+
+    def _apply(self, action: str, apply_batch, rows: list, result: dict, dry_run: bool):
+        """Выполняет пакет в одной транзакции; при нарушении ограничения - построчно."""
+        conn = self.database.connection()
+        if not conn:
+            raise psycopg2.OperationalError("База данных недоступна")
+
+        try:
+            with conn.cursor() as cursor:
+                changed = apply_batch(cursor, rows)
+                if dry_run:
+                    conn.rollback()
+                else:
+                    self._notify(cursor, action, changed)
+                    conn.commit()
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            if len(rows) == 1:
+                result['errors'].append((rows[0]['chat_id'], str(e).strip()))
+                return
+            # Один конфликт (например, занятый телефон) не должен отменять весь пакет
+            for row in rows:
+                self._apply(action, apply_batch, [row], result, dry_run)
+            return
+        except psycopg2.Error as e:
+            self.database.recover(e)
+            raise
+
+        result['applied'] += len(changed)
+        changed = set(changed)
+        result['missing'].extend(row['chat_id'] for row in rows if row['chat_id'] not in changed)
+
+    def _bulk(self, action: str, apply_batch, rows, batch_size: int, dry_run: bool) -> dict:
+        result = {'applied': 0, 'missing': [], 'errors': []}
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._apply(action, apply_batch, batch, result, dry_run)
+                batch = []
+                logging.info(f"INFO: {action}: обработано {result['applied']} записей")
+        if batch:
+            self._apply(action, apply_batch, batch, result, dry_run)
+        return result
+
+    def validate_update(self, row: dict):
+        """Возвращает текст ошибки для строки обновления или None."""
+        if not row.get('chat_id'):
+            return "не указан chat_id"
+        if not any(row.get(field) for field in UPDATABLE_FIELDS):
+            return "нет полей для изменения"
+        if row.get('fio') and not self.database.validate_fio(row['fio']):
+            return "неверный формат ФИО"
+        if row.get('phone') and not self.database.validate_phone(row['phone']):
+            return "неверный формат телефона"
+        if row.get('birth_date') and not self.database.validate_birth_date(row['birth_date']):
+            return "неверная дата рождения"
+        return None
+
+    def bulk_update(self, rows, batch_size: int = BATCH_SIZE, dry_run: bool = False) -> dict:
+        """Обновляет пользователей из строк {'chat_id', 'fio', 'phone', 'birth_date'}.
+
+        Строки с неверными данными пропускаются и попадают в errors.
+        """
+        invalid = []
+
+        def valid_rows():
+            for row in rows:
+                error = self.validate_update(row)
+                if error:
+                    invalid.append((row.get('chat_id'), error))
+                else:
+                    yield row
+
+        result = self._bulk('update', self._update_batch, valid_rows(), batch_size, dry_run)
+        result['errors'] = invalid + result['errors']
+        return result
+
+    def bulk_delete(self, chat_ids, batch_size: int = BATCH_SIZE, dry_run: bool = False) -> dict:
+        """Удаляет пользователей по списку chat_id."""
+        rows = ({'chat_id': chat_id} for chat_id in chat_ids)
+        return self._bulk('delete', self._delete_batch, rows, batch_size, dry_run)
+
+
+def read_rows(path: str):
+    """Читает CSV с заголовком (chat_id и поля для изменения) построчно."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            yield {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+
+def read_chat_ids(path: str):
+    """Читает chat_id по одному в строке либо CSV с колонкой chat_id."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        first = f.readline().strip()
+        if first and first != 'chat_id' and not first.startswith('chat_id,'):
+            yield first.split(',')[0]
+        for line in f:
+            chat_id = line.strip().split(',')[0]
+            if chat_id:
+                yield chat_id
+
+
+def _print_users(users: list, next_after, search_args: str = 'list '):
+    for user in users:
+        print(f"{user['chat_id']:<14} {user['tenant']:<12} {user['phone'] or '-':<13} "
+              f"{user['birth_date'] or '-':<11} {user['fio'] or '-':<40} {user['registration_date']}")
+    if next_after is not None:
+        print(f"\nСледующая страница: {search_args}--after {encode_cursor(next_after)}")
+
+
+def _print_result(result: dict, dry_run: bool):
+    print(f"{'Будет изменено' if dry_run else 'Изменено'}: {result['applied']}")
+    if result['missing']:
+        print(f"Не найдено: {len(result['missing'])} ({', '.join(result['missing'][:20])})")
+    for chat_id, error in result['errors']:
+        print(f"Ошибка {chat_id}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление пользователями для поддержки")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help="Список пользователей по chat_id")
+    list_parser.add_argument('--after', help="Курсор из предыдущей страницы")
+    list_parser.add_argument('--limit', type=int, default=PAGE_SIZE)
+
+    search_parser = subparsers.add_parser('search', help="Поиск по началу телефона или ФИО")
+    search_by = search_parser.add_mutually_exclusive_group(required=True)
+    search_by.add_argument('--phone', help="Начало телефона, например +7912")
+    search_by.add_argument('--fio', help="Начало ФИО, например 'Иванов Пе'")
+    search_parser.add_argument('--after', help="Курсор из предыдущей страницы")
+    search_parser.add_argument('--limit', type=int, default=PAGE_SIZE)
+
+    export_parser = subparsers.add_parser('export', help="Выгрузить всех пользователей в CSV")
+    export_parser.add_argument('file')
+
+    update_parser = subparsers.add_parser('update', help="Исправить данные из CSV: chat_id,fio,phone,birth_date")
+    delete_parser = subparsers.add_parser('delete', help="Удалить пользователей по списку chat_id")
+    for bulk_parser in (update_parser, delete_parser):
+        bulk_parser.add_argument('file')
+        bulk_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        bulk_parser.add_argument('--dry-run', action='store_true', help="Проверить без сохранения")
+
+    subparsers.add_parser('create-indexes', help="Создать индексы для поиска")
+
+    args = parser.parse_args()
+
+    from user_database import db
+
+    if not db.conn:
+        print("Нет подключения к базе данных")
+        return 1
+
+    admin = UserAdmin(db)
+    try:
+        if args.command == 'list':
+            after = decode_cursor(args.after) if args.after else ''
+            _print_users(*admin.list_users(after, args.limit))
+
+        elif args.command == 'search' and args.phone:
+            if db.cipher:
+                print("Шифрование включено: по префиксу ищутся только незашифрованные записи, "
+                      "зашифрованные - по полному номеру\n")
+            after = tuple(decode_cursor(args.after)) if args.after else ('', '')
+            _print_users(*admin.search_by_phone(args.phone, after, args.limit), f"search --phone {args.phone} ")
+
+        elif args.command == 'search':
+            if db.cipher:
+                print("Шифрование включено: зашифрованные ФИО по префиксу не ищутся\n")
+            after = tuple(decode_cursor(args.after)) if args.after else ('', '')
+            _print_users(*admin.search_by_fio(args.fio, after, args.limit), f"search --fio '{args.fio}' ")
+
+        elif args.command == 'export':
+            with open(args.file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['chat_id', 'tenant', 'fio', 'phone', 'birth_date',
+                                                       'registration_date'])
+                writer.writeheader()
+                exported = 0
+                for user in admin.iter_users():
+                    writer.writerow(user)
+                    exported += 1
+            print(f"Выгружено: {exported}")
+
+        elif args.command == 'update':
+            result = admin.bulk_update(read_rows(args.file), args.batch_size, args.dry_run)
+            _print_result(result, args.dry_run)
+
+        elif args.command == 'delete':
+            result = admin.bulk_delete(read_chat_ids(args.file), args.batch_size, args.dry_run)
+            _print_result(result, args.dry_run)
+
+        elif args.command == 'create-indexes':
+            # Построение индекса на большой таблице идет дольше ограничения для запросов бота
+            db.set_query_timeout(None)
+            admin.create_indexes()
+    except psycopg2.Error as e:
+        print(f"Ошибка базы данных: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
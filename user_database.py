@@ -1,11 +1,20 @@
 # user_database.py
 import os
 import re
+import json
+import time
+import select
+import asyncio
 import logging
+from collections import OrderedDict
 from datetime import datetime
 import psycopg2
+import psycopg2.extensions
 from dotenv import load_dotenv
 
+from logging_config import log_error
+from pii_crypto import load_cipher
+
 load_dotenv()
 
 # --- Конфигурация PostgreSQL ---
@@ -14,30 +23,270 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+# Предельное время запроса, сек: запросы бота выполняются в цикле событий
+# и блокируют его, поэтому зависший запрос должен прерываться за секунды
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "5"))
+
+# --- Параметры восстановления соединения ---
+RECONNECT_BASE_DELAY = 0.5  # Первая пауза перед повторным подключением, сек
+RECONNECT_MAX_DELAY = 30.0  # Максимальная пауза между попытками, сек
+MAX_PENDING_REGISTRATIONS = 1000  # Регистрации, отложенные на время недоступности БД
+
+# Организация (бот), к которой относятся записи, если она не указана явно
+DEFAULT_TENANT = 'default'
+
+# Канал уведомлений об изменении пользователей через user_admin
+USERS_CHANGED_CHANNEL = 'users_changed'
+
+
+class DeadlineConnection(psycopg2.extensions.connection):
+    """Соединение, ожидание ответа сервера в котором ограничено query_timeout секундами."""
+    query_timeout = None
+
+
+def _wait_with_deadline(conn):
+    """Ожидание ответа сервера для psycopg2 с ограничением времени на стороне клиента.
+
+    statement_timeout прерывает запрос на сервере, keepalives и tcp_user_timeout
+    обнаруживают пропавший хост, но если сервер или прокси перед ним принимает
+    соединение и молчит, обычный psycopg2 ждал бы ответа бесконечно.
+    """
+    if conn.status == psycopg2.extensions.STATUS_SETUP:
+        # В этом режиме libpq не применяет connect_timeout сам
+        timeout = DB_CONNECT_TIMEOUT
+    else:
+        timeout = getattr(conn, 'query_timeout', None)
+    deadline = time.monotonic() + timeout if timeout else None
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise psycopg2.OperationalError(f"no response from server within {timeout}s")
+        if state == psycopg2.extensions.POLL_READ:
+            select.select([conn.fileno()], [], [], remaining)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            select.select([], [conn.fileno()], [], remaining)
+        else:
+            raise psycopg2.OperationalError(f"bad state from poll: {state}")
+
+
+psycopg2.extensions.set_wait_callback(_wait_with_deadline)
+
+
+def open_connection(query_timeout: float = DB_QUERY_TIMEOUT):
+    """Открывает новое соединение с PostgreSQL по настройкам окружения.
+
+    query_timeout ограничивает каждый запрос (0 или None - без ограничения):
+    на сервере через statement_timeout, на клиенте - временем ожидания ответа.
+    """
+    timeout_ms = int(query_timeout * 1000) if query_timeout else 0
+    # Параметр options заменяет PGOPTIONS, поэтому переданные через окружение настройки сохраняются
+    options = f"{os.getenv('PGOPTIONS', '')} -c statement_timeout={timeout_ms}".strip()
+    conn = psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        options=options,
+        # Полуоткрытое после переключения базы соединение обнаруживается за секунды, а не минуты
+        keepalives=1,
+        keepalives_idle=5,
+        keepalives_interval=2,
+        keepalives_count=3,
+        tcp_user_timeout=timeout_ms or DB_CONNECT_TIMEOUT * 1000,
+        connection_factory=DeadlineConnection
+    )
+    # Клиентский предел чуть больше серверного: медленный запрос отменяет сервер,
+    # а соединение остается рабочим
+    conn.query_timeout = query_timeout + 1 if query_timeout else None
+    return conn
+
+
+def _open_listener():
+    """Соединение, подписанное на USERS_CHANGED_CHANNEL."""
+    conn = open_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {USERS_CHANGED_CHANNEL};")
+    except psycopg2.Error:
+        conn.close()
+        raise
+    return conn
 
 
 class UserDatabase:
-    def __init__(self):
+    def __init__(self, cipher=None, query_timeout: float = DB_QUERY_TIMEOUT):
         self.conn = None
         self.cursor = None
+        # Предельное время запроса (None - без ограничения, для обслуживающих утилит)
+        self.query_timeout = query_timeout
+        # Шифрование ФИО, телефона и даты рождения (None - данные хранятся открыто)
+        self.cipher = cipher
+        # Состояние автомата переподключения (circuit breaker)
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error = None
+        # Регистрации, принятые во время недоступности БД:
+        # chat_id -> (fio, phone, birth_date, registration_date, tenant)
+        self.pending_registrations = OrderedDict()
+        # Отложенные регистрации, отклоненные при записи: chat_id -> registration_date
+        self.rejected_registrations = {}
         self._connect()
         self._init_db()
 
-    def _connect(self):
+    def _connect(self) -> bool:
         """Устанавливает соединение с базой данных PostgreSQL."""
         try:
-            self.conn = psycopg2.connect(
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                host=DB_HOST,
-                port=DB_PORT
-            )
+            self.conn = open_connection(self.query_timeout)
             self.cursor = self.conn.cursor()
+            self.failures = 0
+            self.last_error = None
             logging.info("INFO: Успешное подключение к PostgreSQL для UserDatabase.")
+            return True
         except psycopg2.Error as e:
             logging.error(f"ERROR: Не удалось подключиться к PostgreSQL: {e}")
-            # В реальном приложении здесь нужно поднять исключение или завершить работу
+            self._mark_broken(e)
+            return False
+
+    def _mark_broken(self, error):
+        """Помечает соединение как разорванное и планирует повторное подключение."""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        self.conn = None
+        self.cursor = None
+        self.last_error = str(error)
+        # Экспоненциальная пауза: пока она не истекла, запросы сразу получают отказ
+        delay = min(RECONNECT_BASE_DELAY * 2 ** self.failures, RECONNECT_MAX_DELAY)
+        self.failures += 1
+        self.retry_at = time.monotonic() + delay
+
+    def _ensure_connection(self) -> bool:
+        """Проверяет соединение и при необходимости переподключается."""
+        if self.conn is not None and not self.conn.closed:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+
+        logging.info(f"INFO: Переподключение к PostgreSQL, попытка {self.failures + 1}.")
+        if not self._connect():
+            return False
+        self._init_db()
+        self._flush_pending_registrations()
+        return True
+
+    def set_query_timeout(self, query_timeout):
+        """Меняет предельное время запросов; None снимает ограничение для долгих операций."""
+        self.query_timeout = query_timeout
+        if not self.is_available():
+            return
+        try:
+            self.cursor.execute("SET statement_timeout = %s", (int(query_timeout * 1000) if query_timeout else 0,))
+            self.conn.commit()
+            self.conn.query_timeout = query_timeout + 1 if query_timeout else None
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to set statement timeout, Error: {str(e)}")
+            self.recover(e)
+
+    def recover(self, error):
+        """Откатывает транзакцию после ошибки; разорванное соединение помечает для переподключения."""
+        # Запрос, отмененный по statement_timeout, оставляет соединение рабочим
+        canceled = isinstance(error, psycopg2.extensions.QueryCanceledError)
+        if (isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)) and not canceled) or \
+                self.conn is None or self.conn.closed:
+            self._mark_broken(error)
+            return
+        try:
+            self.conn.rollback()
+        except psycopg2.Error as e:
+            self._mark_broken(e)
+
+    def connection(self):
+        """Возвращает рабочее соединение или None, если база недоступна."""
+        return self.conn if self._ensure_connection() else None
+
+    def is_available(self) -> bool:
+        """Доступна ли база данных в данный момент."""
+        return self.conn is not None and not self.conn.closed
+
+    def status(self) -> dict:
+        """Состояние подключения для проверок готовности."""
+        return {
+            'available': self.is_available(),
+            'failures': self.failures,
+            'retry_in': max(0.0, round(self.retry_at - time.monotonic(), 1)) if not self.is_available() else 0.0,
+            'pending_registrations': len(self.pending_registrations),
+            'rejected_registrations': len(self.rejected_registrations),
+            'last_error': self.last_error,
+        }
+
+    def ping(self) -> bool:
+        """Проверяет соединение легким запросом."""
+        if not self._ensure_connection():
+            return False
+
+        try:
+            self.cursor.execute("SELECT 1")
+            self.cursor.fetchone()
+            return True
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Database ping failed, Error: {str(e)}")
+            self.recover(e)
+            return False
+
+    async def run_supervisor(self, interval: float = 2.0):
+        """Периодически проверяет соединение и восстанавливает его после сбоя."""
+        while True:
+            await asyncio.sleep(interval)
+            self.ping()
+
+    async def run_change_listener(self, callback, interval: float = 1.0):
+        """Передает в callback(action, chat_ids) уведомления об изменении пользователей.
+
+        Слушает канал на отдельном соединении в режиме autocommit: основное
+        соединение держит открытую транзакцию чтения, и уведомления в него не
+        доставлялись бы до ее завершения. Подключение выполняется в отдельном
+        потоке, чтобы не блокировать цикл событий, а после сбоя повторяется с
+        экспоненциальной паузой, как и для основного соединения.
+        """
+        listen_conn = None
+        failures = 0
+        while True:
+            # failures растет только пока соединения нет
+            await asyncio.sleep(min(RECONNECT_BASE_DELAY * 2 ** failures, RECONNECT_MAX_DELAY)
+                                if failures else interval)
+            try:
+                if listen_conn is None or listen_conn.closed:
+                    listen_conn = None
+                    listen_conn = await asyncio.to_thread(_open_listener)
+                    failures = 0
+
+                listen_conn.poll()
+                while listen_conn.notifies:
+                    notify = listen_conn.notifies.pop(0)
+                    try:
+                        change = json.loads(notify.payload)
+                    except ValueError:
+                        logging.warning(f"WARNING: Malformed users change notification: {notify.payload}")
+                        continue
+                    callback(change.get('action'), change.get('chat_ids', []))
+            except psycopg2.Error as e:
+                logging.error(f"ERROR: Users change listener failed, Error: {str(e)}")
+                failures += 1
+                if listen_conn is not None:
+                    listen_conn.close()
+                listen_conn = None
 
     def _init_db(self):
         """Создает таблицу users, если она не существует, и добавляет отсутствующие колонки."""
@@ -46,13 +295,14 @@ class UserDatabase:
 
         try:
             # Создаем таблицу users
-            create_table_query = """
+            create_table_query = f"""
             CREATE TABLE IF NOT EXISTS users (
                 chat_id VARCHAR(255) PRIMARY KEY,
                 fio TEXT NOT NULL,
-                phone VARCHAR(20) UNIQUE NOT NULL,
+                phone VARCHAR(20) NOT NULL,
                 birth_date VARCHAR(10) NOT NULL,
-                registration_date TEXT NOT NULL
+                registration_date TEXT NOT NULL,
+                tenant VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_TENANT}'
             );
             """
             self.cursor.execute(create_table_query)
@@ -60,12 +310,63 @@ class UserDatabase:
             # Проверяем существование колонок и добавляем их если нужно
             self._add_column_if_not_exists('birth_date', 'VARCHAR(10)')
             self._add_column_if_not_exists('registration_date', 'TEXT')
+            self._add_column_if_not_exists('tenant', f"VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_TENANT}'")
+            self._init_tenant_phone_key()
+
+            if self.cipher:
+                self._init_encrypted_columns()
 
             self.conn.commit()
             logging.info("INFO: Таблица users проверена/создана.")
         except psycopg2.Error as e:
             logging.error(f"ERROR: Ошибка при инициализации таблицы users: {e}")
-            self.conn.rollback()
+            self.recover(e)
+
+    def _init_tenant_phone_key(self):
+        """Телефон уникален в пределах организации: пациент может зарегистрироваться в нескольких.
+
+        Таблицы, созданные до появления колонки tenant, хранят ограничение
+        UNIQUE(phone) на всю таблицу - оно заменяется индексом по (tenant, phone).
+        """
+        self.cursor.execute(
+            "SELECT 1 FROM pg_constraint WHERE conrelid = 'users'::regclass AND conname = 'users_phone_key'"
+        )
+        if self.cursor.fetchone():
+            self.cursor.execute("ALTER TABLE users DROP CONSTRAINT users_phone_key;")
+            logging.info("INFO: Уникальность телефона в users ограничена организацией.")
+        # CREATE INDEX IF NOT EXISTS берет блокировку SHARE до проверки существования
+        if not self._index_exists('users_tenant_phone_key'):
+            self.cursor.execute("CREATE UNIQUE INDEX users_tenant_phone_key ON users (tenant, phone);")
+
+    def _init_encrypted_columns(self):
+        """Добавляет колонки для зашифрованных данных и уникальный индекс по хешу телефона."""
+        for column_name in ('fio_enc', 'phone_enc', 'birth_date_enc', 'phone_hash'):
+            self._add_column_if_not_exists(column_name, 'BYTEA')
+
+        # Открытые колонки остаются пустыми для новых записей. DDL выполняется
+        # только если схема еще не приведена: ALTER TABLE и CREATE INDEX берут
+        # блокировку users даже тогда, когда менять нечего
+        self.cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'users'
+          AND column_name IN ('fio', 'phone', 'birth_date') AND is_nullable = 'NO';
+        """)
+        for (column_name,) in self.cursor.fetchall():
+            self.cursor.execute(f"ALTER TABLE users ALTER COLUMN {column_name} DROP NOT NULL;")
+
+        if self._index_exists('users_phone_hash_key'):
+            self.cursor.execute("DROP INDEX users_phone_hash_key;")
+        if not self._index_exists('users_tenant_phone_hash_key'):
+            self.cursor.execute("CREATE UNIQUE INDEX users_tenant_phone_hash_key ON users (tenant, phone_hash);")
+            logging.info("INFO: Создан уникальный индекс по хешу телефона в users.")
+
+    def _index_exists(self, index_name: str) -> bool:
+        """Проверяет, существует ли индекс таблицы users."""
+        self.cursor.execute(
+            "SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'users' AND indexname = %s",
+            (index_name,)
+        )
+        return self.cursor.fetchone() is not None
 
     def _add_column_if_not_exists(self, column_name: str, column_type: str):
         """Добавляет колонку в таблицу users, если она не существует."""
@@ -73,7 +374,7 @@ class UserDatabase:
             check_column_query = """
             SELECT column_name 
             FROM information_schema.columns 
-            WHERE table_name='users' and column_name=%s;
+            WHERE table_schema=current_schema() and table_name='users' and column_name=%s;
             """
             self.cursor.execute(check_column_query, (column_name,))
             if not self.cursor.fetchone():
@@ -82,37 +383,88 @@ class UserDatabase:
                 logging.info(f"INFO: Добавлена колонка {column_name} в таблицу users.")
         except psycopg2.Error as e:
             logging.error(f"ERROR: Ошибка при добавлении колонки {column_name}: {e}")
-            self.conn.rollback()
+            self.recover(e)
 
-    def is_user_registered(self, chat_id: str) -> bool:
-        """Проверяет, зарегистрирован ли пользователь."""
-        if not self.conn:
+    def is_user_registered(self, chat_id: str, tenant: str = DEFAULT_TENANT) -> bool:
+        """Проверяет, зарегистрирован ли пользователь в организации tenant."""
+        pending = self.pending_registrations.get(chat_id)
+        if pending is not None and pending[4] == tenant:
+            return True
+        if not self._ensure_connection():
             return False
 
         try:
-            self.cursor.execute("SELECT 1 FROM users WHERE chat_id = %s", (chat_id,))
+            self.cursor.execute("SELECT 1 FROM users WHERE chat_id = %s AND tenant = %s", (chat_id, tenant))
             result = self.cursor.fetchone()
             return result is not None
         except psycopg2.Error as e:
             logging.error(f"ERROR: Database query failed - User {chat_id}, Error: {str(e)}")
+            self.recover(e)
             return False
 
-    def get_user_greeting(self, chat_id: str) -> str:
+    def get_user_greeting(self, chat_id: str, tenant: str = DEFAULT_TENANT) -> str:
         """Возвращает приветственное имя пользователя (имя и отчество)."""
-        if not self.conn:
+        pending = self.pending_registrations.get(chat_id)
+        if pending is not None and pending[4] == tenant:
+            return self._greeting_from_fio(pending[0])
+        if not self._ensure_connection():
             return "гость"
 
         try:
-            self.cursor.execute("SELECT fio FROM users WHERE chat_id = %s", (chat_id,))
+            if self.cipher:
+                self.cursor.execute("SELECT fio, fio_enc FROM users WHERE chat_id = %s AND tenant = %s",
+                                    (chat_id, tenant))
+            else:
+                self.cursor.execute("SELECT fio, NULL FROM users WHERE chat_id = %s AND tenant = %s",
+                                    (chat_id, tenant))
             row = self.cursor.fetchone()
             if not row:
                 return "гость"
-            fio = row[0].split()
-            return " ".join(fio[1:]) if len(fio) >= 2 else fio[0]
+            return self._greeting_from_fio(self.read_field(row[0], row[1], 'fio'))
+        except ValueError as e:
+            logging.error(f"ERROR: Failed to decrypt user greeting - User {chat_id}, Error: {str(e)}")
+            return "гость"
         except psycopg2.Error as e:
             logging.error(f"ERROR: Failed to get user greeting - User {chat_id}, Error: {str(e)}")
+            self.recover(e)
             return "гость"
 
+    def read_field(self, plain_value, encrypted_value, field: str):
+        """Возвращает значение поля: расшифрованное или открытое (для записей до шифрования)."""
+        if encrypted_value is not None and self.cipher:
+            return self.cipher.decrypt(encrypted_value, field)
+        return plain_value
+
+    def phone_lookup_hash(self, phone: str) -> bytes:
+        """Ключевой хеш телефона для поиска по индексу без расшифровки."""
+        return self.cipher.lookup_hash(phone)
+
+    def find_user_by_phone(self, phone: str, tenant: str = DEFAULT_TENANT):
+        """Возвращает chat_id пользователя организации с указанным телефоном или None."""
+        if not self._ensure_connection():
+            return None
+
+        try:
+            if self.cipher:
+                self.cursor.execute(
+                    "SELECT chat_id FROM users WHERE tenant = %s AND (phone_hash = %s OR phone = %s)",
+                    (tenant, self.phone_lookup_hash(phone), phone)
+                )
+            else:
+                self.cursor.execute("SELECT chat_id FROM users WHERE tenant = %s AND phone = %s", (tenant, phone))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Phone lookup failed, Error: {str(e)}")
+            self.recover(e)
+            return None
+
+    @staticmethod
+    def _greeting_from_fio(fio: str) -> str:
+        """Имя и отчество из ФИО."""
+        parts = fio.split()
+        return " ".join(parts[1:]) if len(parts) >= 2 else parts[0]
+
     def validate_fio(self, fio: str) -> bool:
         """Валидация ФИО: Фамилия Имя Отчество (кириллица, первая буква заглавная, разрешены дефисы в фамилии)."""
         result = bool(re.match(r"^[А-ЯЁ][а-яё]+(-[А-ЯЁ][а-яё]+)? [А-ЯЁ][а-яё]+ [А-ЯЁ][а-яё]+$", fio))
@@ -143,34 +495,177 @@ class UserDatabase:
             logging.warning(f"WARNING: Birth date validation failed - invalid date - Date: {date_str}")
             return False
 
-    def register_user(self, chat_id: str, fio: str, phone: str, birth_date: str) -> bool:
-        """Регистрирует пользователя в базе данных."""
-        if not self.conn:
-            return False
+    def register_user(self, chat_id: str, fio: str, phone: str, birth_date: str,
+                      tenant: str = DEFAULT_TENANT) -> bool:
+        """Регистрирует пользователя организации tenant в базе данных.
+
+        Телефон должен быть уникален в пределах организации. Если база
+        недоступна, регистрация откладывается в очередь и будет записана
+        после восстановления соединения.
+        """
+        # Получаем текущую дату и время в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС
+        registration_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        if not self._ensure_connection():
+            return self._defer_registration(chat_id, fio, phone, birth_date, registration_date, tenant)
+
+        return self._insert_user(chat_id, fio, phone, birth_date, registration_date, tenant)
 
+    def _insert_user(self, chat_id: str, fio: str, phone: str, birth_date: str, registration_date: str,
+                     tenant: str) -> bool:
+        """Записывает пользователя в таблицу users."""
         try:
-            # Получаем текущую дату и время в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС
-            registration_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if self.cipher:
+                # Записи, созданные до включения шифрования, хранят телефон открыто
+                self.cursor.execute("SELECT 1 FROM users WHERE tenant = %s AND phone = %s", (tenant, phone))
+                if self.cursor.fetchone():
+                    raise psycopg2.IntegrityError("duplicate phone in unencrypted row")
 
-            insert_query = """
-            INSERT INTO users (chat_id, fio, phone, birth_date, registration_date) 
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            self.cursor.execute(insert_query, (chat_id, fio, phone, birth_date, registration_date))
+                insert_query = """
+                INSERT INTO users (chat_id, fio_enc, phone_enc, birth_date_enc, phone_hash, registration_date, tenant)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                self.cursor.execute(insert_query, (
+                    chat_id,
+                    self.cipher.encrypt(fio, 'fio'),
+                    self.cipher.encrypt(phone, 'phone'),
+                    self.cipher.encrypt(birth_date, 'birth_date'),
+                    self.phone_lookup_hash(phone),
+                    registration_date,
+                    tenant
+                ))
+            else:
+                insert_query = """
+                INSERT INTO users (chat_id, fio, phone, birth_date, registration_date, tenant) 
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """
+                self.cursor.execute(insert_query, (chat_id, fio, phone, birth_date, registration_date, tenant))
             self.conn.commit()
 
-            logging.info(f"User {chat_id}: user registered in database")
+            logging.info(f"User {chat_id}: user registered in database, tenant: {tenant}")
             return True
 
         except psycopg2.IntegrityError as e:
             logging.error(f"ERROR: User registration failed - duplicate - User {chat_id}, FIO: {fio}, Phone: {phone}")
-            self.conn.rollback()
+            self.recover(e)
             return False
         except psycopg2.Error as e:
             logging.error(f"ERROR: User registration failed - database error - User {chat_id}, Error: {str(e)}")
-            self.conn.rollback()
+            self.recover(e)
+            if not self.is_available():
+                # Соединение потеряно во время записи - откладываем регистрацию
+                return self._defer_registration(chat_id, fio, phone, birth_date, registration_date, tenant)
             return False
 
+    def _defer_registration(self, chat_id: str, fio: str, phone: str, birth_date: str, registration_date: str,
+                            tenant: str) -> bool:
+        """Откладывает регистрацию до восстановления соединения."""
+        if len(self.pending_registrations) >= MAX_PENDING_REGISTRATIONS:
+            logging.error(f"ERROR: User registration failed - database unavailable, queue full - User {chat_id}")
+            return False
+
+        if any(pending[1] == phone and pending[4] == tenant
+               for pending_chat_id, pending in self.pending_registrations.items() if pending_chat_id != chat_id):
+            logging.error(f"ERROR: User registration failed - duplicate in queue - User {chat_id}, Phone: {phone}")
+            return False
+
+        self.pending_registrations[chat_id] = (fio, phone, birth_date, registration_date, tenant)
+        logging.warning(f"WARNING: Database unavailable, registration deferred - User {chat_id}")
+        return True
+
+    def _flush_pending_registrations(self):
+        """Записывает регистрации, накопленные во время недоступности БД.
+
+        Пользователь уже получил сообщение об успешной регистрации, поэтому
+        отклоненная при записи регистрация (дубликат телефона) не пропадает
+        молча, а попадает в журнал ошибок с контактными данными для поддержки.
+        """
+        while self.pending_registrations and self.is_available():
+            chat_id, (fio, phone, birth_date, registration_date, tenant) = next(iter(self.pending_registrations.items()))
+            if not self._insert_user(chat_id, fio, phone, birth_date, registration_date, tenant):
+                if not self.is_available():
+                    # Соединение снова потеряно - попробуем после следующего переподключения
+                    return
+                self.rejected_registrations[chat_id] = registration_date
+                log_error("Deferred registration rejected, contact user",
+                          f"User {chat_id}, Tenant: {tenant}, FIO: {fio}, Phone: {phone}, Birth: {birth_date}, "
+                          f"Registered at: {registration_date}")
+            self.pending_registrations.pop(chat_id, None)
+
+    def pending_snapshot(self) -> dict:
+        """Отложенные регистрации для снимка состояния при остановке.
+
+        Пользователям уже сообщено об успешной регистрации, поэтому очередь
+        переживает перезапуск. С настроенным шифрованием ФИО, телефон и дата
+        рождения сохраняются зашифрованными, без него - так же открыто, как
+        они были бы записаны в users.
+        """
+        entries = []
+        for chat_id, (fio, phone, birth_date, registration_date, tenant) in self.pending_registrations.items():
+            if self.cipher:
+                fio = self.cipher.seal(fio, 'fio')
+                phone = self.cipher.seal(phone, 'phone')
+                birth_date = self.cipher.seal(birth_date, 'birth_date')
+            entries.append([chat_id, fio, phone, birth_date, registration_date, tenant])
+        return {'encrypted': bool(self.cipher), 'entries': entries}
+
+    def restore_pending(self, snapshot: dict):
+        """Возвращает в очередь регистрации из снимка и записывает их, если база доступна."""
+        entries = snapshot.get('entries', [])
+        if snapshot.get('encrypted') and not self.cipher:
+            if entries:
+                log_error("Deferred registrations not restored, PII_MASTER_KEY is not set",
+                          f"Count: {len(entries)}")
+            return
+
+        for chat_id, fio, phone, birth_date, registration_date, tenant in entries:
+            if snapshot.get('encrypted'):
+                try:
+                    fio = self.cipher.unseal(fio, 'fio')
+                    phone = self.cipher.unseal(phone, 'phone')
+                    birth_date = self.cipher.unseal(birth_date, 'birth_date')
+                except ValueError as e:
+                    log_error("Deferred registration not restored, contact user",
+                              f"User {chat_id}, Tenant: {tenant}, Error: {str(e)}")
+                    continue
+            self.pending_registrations.setdefault(chat_id, (fio, phone, birth_date, registration_date, tenant))
+
+        if self.pending_registrations:
+            logging.warning(f"WARNING: Restored deferred registrations: {len(self.pending_registrations)}")
+            self._flush_pending_registrations()
+
+    def encrypt_existing_users(self, batch_size: int = 1000) -> int:
+        """Шифрует записи, сохраненные открыто, и очищает открытые колонки."""
+        if not self.cipher or not self._ensure_connection():
+            return 0
+
+        total = 0
+        try:
+            while True:
+                self.cursor.execute(
+                    "SELECT chat_id, fio, phone, birth_date FROM users "
+                    "WHERE fio_enc IS NULL AND fio IS NOT NULL LIMIT %s FOR UPDATE",
+                    (batch_size,)
+                )
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+
+                self.cursor.executemany(
+                    "UPDATE users SET fio_enc = %s, phone_enc = %s, birth_date_enc = %s, phone_hash = %s, "
+                    "fio = NULL, phone = NULL, birth_date = NULL WHERE chat_id = %s",
+                    [(self.cipher.encrypt(fio, 'fio'), self.cipher.encrypt(phone, 'phone'),
+                      self.cipher.encrypt(birth_date, 'birth_date'), self.phone_lookup_hash(phone), chat_id)
+                     for chat_id, fio, phone, birth_date in rows]
+                )
+                self.conn.commit()
+                total += len(rows)
+                logging.info(f"INFO: Зашифровано записей: {total}")
+        except psycopg2.Error as e:
+            logging.error(f"ERROR: Failed to encrypt existing users, Error: {str(e)}")
+            self.recover(e)
+        return total
+
     def close_connection(self):
         """Закрывает соединение с базой данных."""
         if self.cursor:
@@ -181,4 +676,4 @@ class UserDatabase:
 
 
 # Экземпляр базы, который импортируется в боте
-db = UserDatabase()
\ No newline at end of file
+db = UserDatabase(cipher=load_cipher())
\ No newline at end of file
@@ -0,0 +1,224 @@
+# webhook_server.py
+import asyncio
+import hmac
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from aiohttp import web
+from maxapi.methods.types.getted_updates import process_update_webhook
+
+from logging_config import log_bot_event, log_error, log_warning
+
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+SECRET_HEADER = 'X-Max-Bot-Api-Secret'
+
+# Типы обновлений, на которые подписан бот; остальные отбрасываются без разбора
+ALLOWED_UPDATE_TYPES = frozenset({'message_created', 'message_callback', 'bot_started'})
+
+# Тип обновления ищется в сырых байтах до разбора JSON
+_UPDATE_TYPE_PATTERN = re.compile(rb'"update_type"\s*:\s*"([a-z_]{1,64})"')
+
+
+async def prepare_dispatcher(bot, dispatcher, check_me: bool = True):
+    """Готовит диспетчер к обработке обновлений так же, как запуск сервера maxapi.
+
+    maxapi подключает обработчики диспетчера (добавляет его в список его же
+    роутеров) только внутри handle_webhook/start_polling; без этого
+    Dispatcher.handle пропускает все обновления.
+    """
+    dispatcher.bot = bot
+    if check_me and hasattr(dispatcher, 'check_me'):
+        await dispatcher.check_me()
+    if dispatcher not in dispatcher.routers:
+        dispatcher.routers.append(dispatcher)
+    for router in dispatcher.routers:
+        router.bot = bot
+
+
+class RateLimiter:
+    """Ограничение частоты запросов по IP-адресу (token bucket).
+
+    Корзины хранятся в порядке последнего обращения; при переполнении
+    вытесняется источник, дольше всех не присылавший запросов, поэтому поток
+    новых адресов не сбрасывает лимиты активных источников.
+    """
+
+    def __init__(self, rate: float = 50.0, burst: int = 100, max_sources: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        self.buckets = OrderedDict()
+
+    def allow(self, source: str) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            while len(self.buckets) >= self.max_sources:
+                self.buckets.popitem(last=False)
+            tokens, updated_at = self.burst, now
+        else:
+            self.buckets.move_to_end(source)
+            tokens, updated_at = bucket
+
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self.buckets[source] = (tokens, now)
+            return False
+        self.buckets[source] = (tokens - 1, now)
+        return True
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука с дешевой ранней отбраковкой запросов.
+
+    До разбора обновления в pydantic-модели проверяются: прием запросов
+    (при остановке - 503, чтобы MAX повторил доставку), секрет вебхука и
+    лимит частоты по IP для запросов без него, размер тела и тип обновления. Пути вебхука сопоставлены
+    парам (Bot, Dispatcher).
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 80, secret: str = WEBHOOK_SECRET,
+                 max_body_size: int = 64 * 1024, rate_limiter: RateLimiter = None,
+                 trust_forwarded: int = 0, recorder=None, lifecycle=None):
+        self.host = host
+        self.port = port
+        self.secret = secret.encode() if secret else None
+        self.max_body_size = max_body_size
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Число доверенных прокси перед сервером (0 - X-Forwarded-For не учитывается)
+        self.trust_forwarded = int(trust_forwarded)
+        # Необязательная запись принятых обновлений для offline-воспроизведения
+        self.recorder = recorder
+        # BotLifecycle: запрос учитывается как выполняющаяся работа с момента приема
+        self.lifecycle = lifecycle
+        self.routes = {}
+        self.accepting = True
+        self.rejected = {}
+        self.runner = None
+        self._stopped = None
+
+    def add_route(self, path: str, bot, dispatcher, allowed_update_types=ALLOWED_UPDATE_TYPES):
+        """Регистрирует путь вебхука для бота."""
+        self.routes[path] = (bot, dispatcher, allowed_update_types)
+
+    def stop_accepting(self):
+        """Перестает принимать обновления: новые запросы получают 503."""
+        self.accepting = False
+
+    def _count(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def _reject(self, reason: str, status: int) -> web.Response:
+        self._count(reason)
+        return web.Response(status=status)
+
+    def _source(self, request: web.Request) -> str:
+        # Каждый доверенный прокси дописывает адрес справа; левые записи
+        # присылает сам клиент и может подменять их в каждом запросе
+        if self.trust_forwarded:
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                addresses = [address.strip() for address in forwarded.split(',')]
+                return addresses[max(len(addresses) - self.trust_forwarded, 0)]
+        return request.remote or 'unknown'
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.accepting:
+            return self._reject('shutdown', 503)
+        if self.lifecycle is None:
+            return await self._handle(request)
+
+        # Остановка ждет все принятые запросы, включая разбор обновления в
+        # process_update_webhook; после ее начала новые запросы получают 503
+        if not self.lifecycle.begin():
+            return self._reject('shutdown', 503)
+        try:
+            return await self._handle(request)
+        finally:
+            self.lifecycle.end()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+
+        # С секретом лимит частоты применяется только к неподписанным запросам,
+        # чтобы всплеск легитимного трафика от MAX не получал 429
+        authenticated = False
+        if self.secret is not None:
+            provided = request.headers.get(SECRET_HEADER, '').encode()
+            authenticated = hmac.compare_digest(provided, self.secret)
+
+        if not authenticated and not self.rate_limiter.allow(self._source(request)):
+            return self._reject('rate_limited', 429)
+
+        if self.secret is not None and not authenticated:
+            return self._reject('bad_secret', 401)
+
+        if request.content_length is not None and request.content_length > self.max_body_size:
+            return self._reject('too_large', 413)
+
+        bot, dispatcher, allowed_update_types = self.routes[request.path]
+        try:
+            # Тело читается целиком (в том числе chunked); предел задан client_max_size
+            body = await request.read()
+        except web.HTTPRequestEntityTooLarge:
+            return self._reject('too_large', 413)
+
+        match = _UPDATE_TYPE_PATTERN.search(body)
+        if not match:
+            return self._reject('malformed', 400)
+        if match.group(1).decode() not in allowed_update_types:
+            # Корректный запрос MAX с ненужным нам типом - подтверждаем, чтобы не было повторов
+            self._count('ignored_type')
+            return web.json_response({'ok': True})
+
+        try:
+            event_json = json.loads(body)
+        except ValueError:
+            return self._reject('malformed', 400)
+        if not isinstance(event_json, dict) or event_json.get('update_type') not in allowed_update_types:
+            return self._reject('malformed', 400)
+
+        if self.recorder is not None:
+            self.recorder.record(body)
+
+        try:
+            event_object = await process_update_webhook(event_json=event_json, bot=bot)
+            await dispatcher.handle(event_object)
+        except Exception as e:
+            log_error("Webhook update processing failed", f"Type: {event_json.get('update_type')}, Error: {str(e)}")
+            return web.json_response({'ok': False}, status=500)
+
+        return web.json_response({'ok': True})
+
+    async def start(self):
+        """Подготавливает диспетчеры и запускает HTTP-сервер."""
+        for bot, dispatcher, _ in self.routes.values():
+            await prepare_dispatcher(bot, dispatcher)
+
+        app = web.Application(client_max_size=self.max_body_size)
+        for path in self.routes:
+            app.router.add_post(path, self.handle)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log_bot_event("Webhook server started", f"Port: {self.port}, Paths: {', '.join(self.routes)}")
+
+    async def serve(self):
+        """Запускает сервер и работает до вызова stop()."""
+        self._stopped = asyncio.Event()
+        await self.start()
+        await self._stopped.wait()
+
+    async def stop(self):
+        """Останавливает HTTP-сервер."""
+        self.accepting = False
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        if self._stopped:
+            self._stopped.set()
+        if self.rejected:
+            log_warning("Webhook requests rejected", ", ".join(f"{k}: {v}" for k, v in self.rejected.items()))